@@ -0,0 +1,135 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os, json, random, datetime, argparse
+
+WORDS = (
+	"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut "
+	"labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris "
+	"nisi aliquip ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse "
+	"cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui "
+	"officia deserunt mollit anim id est laborum"
+).split()
+
+HOST_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>Benchmark</title></head>
+<body>
+<main>
+    <section class="preview">
+    </section>
+</main>
+</body>
+</html>
+"""
+
+CONFIG = {
+	"site_url": "https://www.example.com",
+	"has_pagination": True,
+	"has_tag_pagination": True,
+	"page_limit": 10,
+	"has_preview": True,
+	"preview_class": "preview",
+	"has_archive": True,
+	"has_tags": True,
+	"has_feed": True
+}
+
+def makeSentence(rand, words):
+	sentence = " ".join(rand.choice(WORDS) for i in range(words))
+	return sentence[0].upper() + sentence[1:] + "."
+
+def makeBody(rand, paragraphs, markdown):
+	blocks = []
+
+	for i in range(paragraphs):
+		text = " ".join(makeSentence(rand, rand.randint(6, 18)) for j in range(rand.randint(3, 7)))
+
+		if markdown:
+			if i % 4 == 1: blocks.append("## " + makeSentence(rand, 4)[:-1])
+			if i % 5 == 2: blocks.append("* " + "\n* ".join(makeSentence(rand, 5) for j in range(3)))
+			blocks.append(text.replace(" dolor ", " **dolor** ", 1))
+		else:
+			if i % 4 == 1: blocks.append("<h2>{}</h2>".format(makeSentence(rand, 4)[:-1]))
+			blocks.append("<p>{}</p>".format(text))
+
+		if i == 0: blocks.append("<!-- nvpr -->")
+
+	return "\n\n".join(blocks)
+
+def makePost(rand, index, paragraphs, tags, tags_per_post, extra_headers, markdown):
+	#headers in the format read by the meta extension or by readHeaders respectively
+	date = datetime.date(2000, 1, 1) + datetime.timedelta(days=index)
+	headers = [
+		("title", makeSentence(rand, rand.randint(2, 6))[:-1]),
+		("date", date.isoformat())
+	]
+
+	if tags:
+		headers.append(("tags", ", ".join(sorted(set(rand.choice(tags) for i in range(tags_per_post))))))
+	for i in range(extra_headers):
+		headers.append(("field{}".format(i), makeSentence(rand, 3)))
+
+	body = makeBody(rand, paragraphs, markdown)
+
+	if markdown: return "\n".join("{}: {}".format(k, v) for k, v in headers) + "\n\n" + body + "\n"
+	return "\n".join("<!-- {}: {} -->".format(k, v) for k, v in headers) + "\n" + body + "\n"
+
+def makeCorpus(target, posts, paragraphs=6, tag_count=20, tags_per_post=3, extra_headers=0, html_ratio=0.1, seed=0):
+	#writes a complete site: posts, a config and a host page for insertPreview
+	rand = random.Random(seed)
+	content = os.path.join(target, "resources", "content")
+	tags = ["tag{}".format(i) for i in range(tag_count)]
+	os.makedirs(content, exist_ok=True)
+
+	for i in range(posts):
+		markdown = rand.random() >= html_ratio
+		filename = os.path.join(content, "post{:06d}.{}".format(i, "md" if markdown else "html"))
+
+		with open(filename, "w") as file:
+			file.write(makePost(rand, i, paragraphs, tags, tags_per_post, extra_headers, markdown))
+
+	with open(os.path.join(target, "resources", "trakai.json"), "w") as file:
+		json.dump(CONFIG, file, indent="\t")
+	with open(os.path.join(target, "index.html"), "w") as file:
+		file.write(HOST_PAGE)
+
+	return sorted(os.path.join(content, name) for name in os.listdir(content))
+
+def editPost(filename):
+	#changes the body of a post without touching its headers
+	with open(filename, "a") as file: file.write("\nEdited for the benchmark.\n")
+
+def main():
+	parser = argparse.ArgumentParser(description="writes a synthetic trakai site for benchmarking")
+	parser.add_argument("target", help="the directory to write the site to")
+	parser.add_argument("-n", "--posts", default=100, type=int, help="the number of posts")
+	parser.add_argument("-p", "--paragraphs", default=6, type=int, help="the number of paragraphs in each post")
+	parser.add_argument("-t", "--tags", default=20, type=int, help="the number of distinct tags")
+	parser.add_argument("--tags-per-post", default=3, type=int, help="the number of tags given to each post")
+	parser.add_argument("--extra-headers", default=0, type=int, help="the number of extra header fields in each post")
+	parser.add_argument("--html-ratio", default=0.1, type=float, help="the share of posts written as html rather than markdown")
+	parser.add_argument("--seed", default=0, type=int, help="the random seed; the same seed gives the same corpus")
+
+	args = parser.parse_args()
+	makeCorpus(args.target, args.posts, args.paragraphs, args.tags, args.tags_per_post, args.extra_headers, args.html_ratio, args.seed)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,170 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os, sys, json, time, shutil, argparse, platform, tempfile
+from functools import wraps
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trakai.build
+from trakai import __version__
+from corpus import makeCorpus, editPost, HOST_PAGE
+
+SCENARIOS = ("cold", "cached", "edit", "uncached")
+
+def getStage(name, params):
+	#list stages are told apart by the page mode they are rendered with
+	mode = params.get("page_mode")
+	if mode in ("feed", "archive", "tags"): return mode
+	return name
+
+def instrument(timings, counts):
+	#wraps the stages called by generateSite, and generateSite itself
+	originals = {}
+
+	def wrap(name, func):
+		@wraps(func)
+		def timed(*args, **kwargs):
+			stage = getStage(name, kwargs)
+			start = time.perf_counter()
+			try: return func(*args, **kwargs)
+			finally:
+				timings[stage] += time.perf_counter() - start
+				counts[stage] += 1
+		return timed
+
+	for name in ("generateSite", "makePages", "makeList", "makePaginatedList", "makeArchive", "insertPreview", "getTaggedPosts"):
+		originals[name] = getattr(trakai.build, name)
+		setattr(trakai.build, name, wrap(name, originals[name]))
+
+	return originals
+
+def resetSite(site):
+	for folder in ("blog", os.path.join("resources", "backup")):
+		shutil.rmtree(os.path.join(site, folder), ignore_errors=True)
+	with open(os.path.join(site, "index.html"), "w") as file: file.write(HOST_PAGE)
+
+def runBuild(site, cache, jobs):
+	timings, counts = defaultdict(float), defaultdict(int)
+	originals = instrument(timings, counts)
+	cwd = os.getcwd()
+	start = time.perf_counter()
+
+	try:
+		trakai.build.setupSite(path=site, config="resources/trakai.json", silent=True, cache=cache, nocache=cache, jobs=jobs, fastpath=True)
+	finally:
+		total = time.perf_counter() - start
+		os.chdir(cwd)
+		for name, func in originals.items(): setattr(trakai.build, name, func)
+
+	timings["setupSite"] = total - timings["generateSite"]
+	return { "total": total, "stages": dict(timings), "calls": dict(counts) }
+
+def runScenario(site, files, scenario, jobs):
+	#each scenario starts from a clean site; the builds that prepare it are not timed
+	resetSite(site)
+
+	if scenario == "cold": return runBuild(site, True, jobs)
+	if scenario == "uncached": return runBuild(site, False, jobs)
+
+	runBuild(site, True, jobs)
+	if scenario == "edit": editPost(files[len(files) // 2])
+	return runBuild(site, True, jobs)
+
+def benchmark(sizes, scenarios, repeat, jobs, corpus_args):
+	results = []
+
+	for size in sizes:
+		site = tempfile.mkdtemp(prefix="trakai-bench-")
+
+		try:
+			files = makeCorpus(site, size, **corpus_args)
+
+			for scenario in scenarios:
+				#the fastest run is kept, as it has the least noise
+				runs = [runScenario(site, files, scenario, jobs) for i in range(repeat)]
+				best = min(runs, key=lambda run: run["total"])
+				results.append({ "posts": size, "scenario": scenario, **best })
+				sys.stderr.write("{:>8} posts  {:<9} {:>10.3f}s\n".format(size, scenario, best["total"]))
+		finally:
+			shutil.rmtree(site, ignore_errors=True)
+
+	return {
+		"trakai": __version__,
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"jobs": jobs,
+		"corpus": corpus_args,
+		"results": results
+	}
+
+def compare(base, new):
+	#prints the change in total and per-stage time between two result files
+	key = lambda result: (result["posts"], result["scenario"])
+	old = { key(result): result for result in base["results"] }
+
+	print("{:>8}  {:<9} {:<18}{:>12}{:>12}{:>9}".format("posts", "scenario", "stage", "base (s)", "new (s)", "ratio"))
+
+	for result in new["results"]:
+		if key(result) not in old: continue
+		previous = old[key(result)]
+		rows = [("total", previous["total"], result["total"])]
+		rows += [(stage, previous["stages"].get(stage, 0), time) for stage, time in sorted(result["stages"].items())]
+
+		for stage, before, after in rows:
+			ratio = after / before if before else float("nan")
+			print("{:>8}  {:<9} {:<18}{:>12.4f}{:>12.4f}{:>8.2f}x".format(result["posts"], result["scenario"], stage, before, after, ratio))
+
+def main():
+	parser = argparse.ArgumentParser(description="benchmarks trakai builds of synthetic sites")
+	parser.add_argument("-s", "--sizes", default="10,100,1000", help="comma separated post counts; defaults to 10,100,1000")
+	parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenarios out of " + ", ".join(SCENARIOS))
+	parser.add_argument("-r", "--repeat", default=3, type=int, help="the number of runs of each scenario; the fastest is kept")
+	parser.add_argument("-j", "--jobs", default=1, type=int, help="the number of build workers")
+	parser.add_argument("-p", "--paragraphs", default=6, type=int, help="the number of paragraphs in each post")
+	parser.add_argument("-t", "--tags", default=20, type=int, help="the number of distinct tags")
+	parser.add_argument("--tags-per-post", default=3, type=int, help="the number of tags given to each post")
+	parser.add_argument("--extra-headers", default=0, type=int, help="the number of extra header fields in each post")
+	parser.add_argument("-o", "--output", default=None, help="writes the results as json to this file rather than stdout")
+	parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compares two result files instead of running")
+
+	args = parser.parse_args()
+
+	if args.compare:
+		with open(args.compare[0]) as base, open(args.compare[1]) as new:
+			compare(json.load(base), json.load(new))
+		return
+
+	corpus_args = {
+		"paragraphs": args.paragraphs,
+		"tag_count": args.tags,
+		"tags_per_post": args.tags_per_post,
+		"extra_headers": args.extra_headers
+	}
+	results = benchmark([int(size) for size in args.sizes.split(",")], args.scenarios.split(","), args.repeat, args.jobs, corpus_args)
+
+	if args.output:
+		with open(args.output, "w") as file: json.dump(results, file, indent="\t")
+	else:
+		json.dump(results, sys.stdout, indent="\t")
+
+if __name__ == "__main__": main()
@@ -56,11 +56,16 @@ setuptools.setup(
 		"Topic :: Internet :: WWW/HTTP",
 		"Topic :: Internet :: WWW/HTTP :: Site Management"
 	],
-	python_requires = ">=3.6",
+	python_requires = ">=3.7",
 	install_requires = [
 		"jinja2>=2.11.0",
 		"markdown>=3.3.0"
 	],
+	extras_require = {
+		"markdown-it": ["markdown-it-py"],
+		"mistune": ["mistune"],
+		"commonmark": ["commonmark"]
+	},
 	entry_points = {
 		"console_scripts": [
 			"trakai=trakai.__main__:main"
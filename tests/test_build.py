@@ -0,0 +1,274 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import os, sys, json, types, random, shutil, hashlib, subprocess
+import pytest
+from trakai.build import Site, setupSite
+from trakai.output import findPreview, backupPreview
+from trakai.postprocess import minifyMarkup, minifyStream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, "example")
+PACKAGED = os.path.join(ROOT, "trakai", "templates")
+
+def copySite(target):
+	shutil.copytree(EXAMPLE, str(target))
+	return target
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+	#setupSite changes the working directory, which monkeypatch restores afterwards
+	monkeypatch.chdir(tmp_path)
+	return copySite(tmp_path / "site")
+	
+def build(site, cache=True, **args):
+	return setupSite(path=str(site), config="resources/trakai.json", silent=True, cache=cache, nocache=True, **args)
+	
+def readOutputs(site):
+	#every file of a built site by its path in the site, leaving out the sources and build state
+	outputs = {}
+	
+	for root, dirs, files in os.walk(str(site)):
+		if os.path.relpath(root, str(site)) == ".": dirs.remove("resources")
+		for name in files:
+			with open(os.path.join(root, name), "rb") as file:
+				outputs[os.path.relpath(os.path.join(root, name), str(site))] = file.read()
+				
+	return outputs
+	
+def runTrakai(*args):
+	return subprocess.run([sys.executable, "-m", "trakai"] + list(args), cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
+		universal_newlines=True)
+	
+def readManifest(site):
+	with open(str(site / "resources" / "backup" / "trakai_manifest.json"), "r") as file:
+		return json.load(file)
+		
+def configure(site, **params):
+	config = site / "resources" / "trakai.json"
+	config.write_text(json.dumps(dict(json.loads(config.read_text()), **params)))
+	
+def testJobs(site, tmp_path):
+	#parallel builds give the same output as serial ones
+	other = copySite(tmp_path / "other")
+	build(site, cache=False)
+	build(other, cache=False, jobs=2)
+	
+	assert readOutputs(site) == readOutputs(other)
+	assert "blog/posts/test2.html" in readOutputs(site)
+	
+def testFragmentTemplates(site):
+	#lists are cached by their templates, which include the layouts of their fragments
+	build(site)
+	
+	for name, old, new in (("entry.html", "Read More", "READ MORE NOW"), ("item.xml", "<item>", "<item><!-- edited -->")):
+		with open(os.path.join(PACKAGED, name), "r") as file:
+			text = file.read().replace(old, new)
+		with open(str(site / "resources" / "templates" / name), "w") as file: 
+			file.write(text)
+			
+	build(site)
+	
+	for page in ("index.html", "pages/2.html", "archive.html", "tags/cat.html"):
+		assert "READ MORE NOW" in (site / "blog" / page).read_text()
+	assert "<!-- edited -->" in (site / "blog" / "feed.xml").read_text()
+	
+def testRelativeSitePath(site):
+	#the working directory is the parent of the site, as when running trakai site
+	build("site")
+	assert (site / "blog" / "index.html").is_file()
+	
+def testManifest(site):
+	#the manifest lists every output, and what the last build wrote and removed
+	build(site)
+	manifest = readManifest(site)
+	assert "blog/posts/test1.html" in manifest["files"] and "blog/posts/test1.html" in manifest["written"]
+	assert manifest["removed"] == []
+	
+	os.remove(str(site / "resources" / "content" / "test1.md"))
+	build(site)
+	manifest = readManifest(site)
+	assert manifest["removed"] == ["blog/posts/test1.html"]
+	assert "blog/posts/test1.html" not in manifest["files"]
+	assert "blog/index.html" in manifest["written"] and "blog/posts/test2.html" not in manifest["written"]
+	assert not (site / "blog" / "posts" / "test1.html").exists()
+	
+	build(site)
+	manifest = readManifest(site)
+	assert manifest["written"] == [] and manifest["removed"] == []
+	
+def testRemovedTag(site):
+	#a tag whose last post is deleted loses its page, and the other tags are kept
+	build(site)
+	assert (site / "blog" / "tags" / "cat.html").is_file()
+	
+	os.remove(str(site / "resources" / "content" / "test6.md"))
+	build(site)
+	manifest = readManifest(site)
+	assert not (site / "blog" / "tags" / "cat.html").exists()
+	assert "blog/tags/cat.html" in manifest["removed"]
+	assert "blog/tags/dog.html" in manifest["written"] and "blog/tags/chicken.html" not in manifest["written"]
+	
+def testFindPreview():
+	#the preview replaces the lines between those of its opening and closing tags, with
+	#nested elements of the same tag, comments and scripts skipped
+	page = (
+		"<body>\n"
+		"<!-- <div class=\"preview\"> -->\n"
+		"<div id=\"x\" class=\"box preview\">\n"
+		"<div>old</div>\n"
+		"<script>var s = \"</div>\";</script>\n"
+		"</div>\n"
+		"</body>\n"
+	)
+	start, end = findPreview(page, "preview")
+	assert page[:start] == "<body>\n<!-- <div class=\"preview\"> -->\n<div id=\"x\" class=\"box preview\">"
+	assert page[end:] == "</div>\n</body>\n"
+	assert findPreview(page, "missing") is None
+	
+def testBackupLimit(tmp_path):
+	#only the newest backup_limit backups of each host page are kept
+	env = types.SimpleNamespace(globals={ "backup_path": str(tmp_path), "backup_limit": 2 })
+	
+	for i in range(3):
+		(tmp_path / "index.{}.html".format(1000 + i)).write_text("old")
+		os.utime(str(tmp_path / "index.{}.html".format(1000 + i)), ns=(i * 10**9, i * 10**9))
+	(tmp_path / "other.1000.html").write_text("other")
+	
+	backupPreview(env, "index.html", "new")
+	names = os.listdir(str(tmp_path))
+	assert len(names) == 3 and "index.1002.html" in names and "other.1000.html" in names
+	assert "index.1000.html" not in names and "index.1001.html" not in names
+	
+def testFastPath(site):
+	#an unchanged site is skipped without importing jinja, but only when asked for, so
+	#that library callers still get the environment
+	build(site)
+	code = ("import sys; from trakai.build import setupSite; "
+		"env = setupSite(path=sys.argv[1], config='resources/trakai.json', silent=True, cache=True, nocache=True, fastpath=True); "
+		"print(env is None, 'jinja2' in sys.modules)")
+	result = subprocess.run([sys.executable, "-c", code, str(site)], cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+	
+	assert result.stdout.split() == ["True", "False"]
+	assert build(site) is not None
+	
+def testMinifyStream(site):
+	#minifying chunk by chunk gives the same result as minifying the whole page, 
+	#however the page is split
+	build(site, cache=False)
+	pages = [(site / "blog" / name).read_text() for name in ("index.html", "feed.xml", "posts/test1.html")]
+	pages.append("<p>a  \n b</p><pre> x  y </pre><!-- c > d --><!-- nvpr --><script>if (a < b) {}</script>"
+		"<![CDATA[ e   f ]]><textarea>  g</textarea> h <i>  i </i> < j")
+	rand = random.Random(0)
+	
+	for page in pages:
+		for i in range(50):
+			cuts = sorted(rand.sample(range(len(page)), min(len(page) - 1, rand.randint(1, 40))))
+			chunks = [page[a:b] for a, b in zip([0] + cuts, cuts + [len(page)])]
+			assert "".join(minifyStream(chunks)) == minifyMarkup(page)
+	
+def testShards(site, tmp_path):
+	#shards built separately and merged give the same site as a single build
+	other = copySite(tmp_path / "other")
+	build(other)
+	
+	for i in range(3):
+		assert runTrakai(str(site), "-s", "-a", "--shard", "{}/3".format(i)).returncode == 0
+	assert runTrakai("merge", str(site), "-s", "-a").returncode == 0
+	
+	assert readOutputs(site) == readOutputs(other)
+	
+def testMissingShard(site):
+	for i in (0, 2):
+		assert runTrakai(str(site), "-s", "-a", "--shard", "{}/3".format(i)).returncode == 0
+	result = runTrakai("merge", str(site), "-s", "-a")
+	
+	assert result.returncode != 0
+	assert "shards 1 of 3 are missing" in result.stderr
+	
+def testSearchIndex(site, tmp_path):
+	#only the shards of the terms of changed posts are rebuilt, and the index matches 
+	#that of a build from scratch
+	other = copySite(tmp_path / "other")
+	
+	for target in (site, other): configure(target, has_search=True)
+		
+	build(site)
+	build(site)
+	assert not [dst for dst in readManifest(site)["written"] if "/search/" in dst]
+	
+	for target in (site, other):
+		with open(str(target / "resources" / "content" / "test1.md"), "a") as file: file.write("\nzzqux\n")
+	build(site)
+	build(other, cache=False)
+	
+	shard = "blog/search/" + hashlib.md5(b"zz").hexdigest()[:12] + ".json"
+	written = [dst for dst in readManifest(site)["written"] if "/search/" in dst]
+	assert shard in written and len(written) < len([dst for dst in readOutputs(site) if "/search/" in dst])
+	assert { k: v for k, v in readOutputs(site).items() if "/search/" in k } == { k: v for k, v in readOutputs(other).items() if "/search/" in k }
+	
+	os.remove(str(site / "resources" / "content" / "test1.md"))
+	build(site)
+	assert shard in readManifest(site)["removed"] and not (site / shard).exists()
+	
+def testSite(site):
+	#update and remove render only what their posts affect, and return the files written
+	resident = Site(str(site))
+	written = resident.build()
+	assert "blog/posts/test1.html" in written and "blog/index.html" in written
+	assert resident.update(["resources/content/test1.md"]) == []
+	
+	shutil.copy(str(site / "resources" / "content" / "test2.md"), str(site / "resources" / "content" / "test7.md"))
+	written = resident.update([str(site / "resources" / "content" / "test7.md")])
+	assert "blog/posts/test7.html" in written and "blog/posts/test1.html" not in written
+	
+	written = resident.remove(["resources/content/test7.md"])
+	assert "blog/index.html" in written and "blog/posts/test7.html" not in written
+	assert not (site / "blog" / "posts" / "test7.html").exists()
+	
+	with pytest.raises(TypeError):
+		Site(str(site), cache=False)
+		
+def testSiteRemove(site):
+	#removing before any build renders once, without the removed post
+	written = Site(str(site)).remove(["resources/content/test2.md"])
+	assert "blog/index.html" in written and "blog/posts/test3.html" in written
+	assert "blog/posts/test2.html" not in written
+	
+def testArchivePeriods(site):
+	#the archive gets a page per period, linked from an index of the periods
+	configure(site, archive_period="year", feed_limit=3)
+	build(site)
+	index = (site / "blog" / "archive.html").read_text()
+	
+	for year in ("2013", "2014", "2016", "2017", "2018", "2019"):
+		assert "/blog/archive/{}.html".format(year) in index
+		assert "/blog/archive.html\">All archives" in (site / "blog" / "archive" / (year + ".html")).read_text()
+	assert "posts/test2.html" in (site / "blog" / "archive" / "2019.html").read_text()
+	assert "posts/test2.html" not in (site / "blog" / "archive" / "2018.html").read_text()
+	assert (site / "blog" / "feed.xml").read_text().count("<item>") == 3
+	
+	configure(site, archive_period="month")
+	build(site)
+	assert ">January 2019</a>" in (site / "blog" / "archive.html").read_text()
+	assert "posts/test2.html" in (site / "blog" / "archive" / "2019-01.html").read_text()
+	assert not (site / "blog" / "archive" / "2019.html").exists()
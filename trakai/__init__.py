@@ -19,7 +19,28 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from .output import makePages, makeList, makePaginatedList, insertPreview, getTaggedPosts
-from .parsing import readContent
-from .build import setupSite, generateSite
-from .version import __version__
\ No newline at end of file
+from .version import __version__
+
+#submodules are imported on first use, so that importing trakai, or running 
+#trakai --version, does not load jinja and markdown
+EXPORTS = {
+	"makePages": "output",
+	"makeList": "output",
+	"makePaginatedList": "output",
+	"insertPreview": "output",
+	"getTaggedPosts": "output",
+	"readContent": "parsing",
+	"setupSite": "build",
+	"generateSite": "build",
+	"Site": "build",
+}
+
+def __getattr__(name):
+	if name not in EXPORTS: 
+		raise AttributeError("module 'trakai' has no attribute '{}'".format(name))
+	
+	import importlib
+	return getattr(importlib.import_module("." + EXPORTS[name], __name__), name)
+	
+def __dir__():
+	return sorted(list(globals()) + list(EXPORTS))
\ No newline at end of file
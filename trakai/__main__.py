@@ -19,9 +19,8 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import argparse, os
+import argparse, os, sys
 from .version import __version__
-from .build import setupSite
 
 def checkPath(path):
     if not path or not os.path.exists(path):
@@ -35,18 +34,28 @@ def checkDir(path):
         raise argparse.ArgumentTypeError(path + "is not a directory")
     return path
     
-def main():
-    parser = argparse.ArgumentParser(prog="trakai", description="a simple blog generator designed specially to integrate into existing sites")
+def checkShard(shard):
+    try:
+        index, total = (int(x) for x in shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(shard + " is not a shard in the form i/N")
+        
+    if total < 1 or not 0 <= index < total:
+        raise argparse.ArgumentTypeError(shard + " is not a shard between 0/N and N-1/N")
+    return index, total
     
+def addBuildArguments(parser):
     parser.add_argument("path", nargs="?", default=os.getcwd(), type=checkDir, help="the path of the site; defaults to the current directory")
     parser.add_argument("-v","--version", action="version", version="trakai v" + __version__, help="outputs the installed version")
     parser.add_argument("-s","--silent", action="store_true", help="generates the site without printing information to stdout")
     parser.add_argument("-a", "--cache", action="store_true", help="always use the cache, regardless of config, and only write changed files")
     parser.add_argument("-n", "--nocache", action="store_false", help="never use the cache, regardless of config, and write all files")
+    parser.add_argument("-j", "--jobs", default=None, type=int, help="the number of processes used to parse and render posts; 0 uses every core")
     parser.add_argument("-c", "--config", default=None, type=checkPath, help="specifies an alternate location for configuration files")
+    parser.add_argument("--profile", nargs="?", const="resources/backup/trakai_profile.json", default=None, help="records stage, post and template timings, written as a json report and a chrome trace; defaults to resources/backup/trakai_profile.json")
+    parser.add_argument("--profile-hook", default=None, choices=["cprofile", "tracemalloc"], help="also runs cProfile or tracemalloc while profiling")
     
-    args = vars(parser.parse_args())
-    
+def checkArgs(args):
     if args["cache"] and not args["nocache"]:
         print("trakai: error: cache and nocache are mutually exclusive")
         exit(1)
@@ -54,7 +63,125 @@ def main():
     elif args["config"] is None: 
         args["config"] = "resources/trakai.json"
         
-    setupSite(**args)
+    return args
+    
+def serve(argv):
+    from .build import setupSite
+    from .serve import serveSite
+    
+    parser = argparse.ArgumentParser(prog="trakai serve", description="builds the site, then serves it locally and rebuilds it whenever posts or templates change")
+    addBuildArguments(parser)
+    parser.add_argument("-p", "--port", default=8000, type=int, help="the port to serve the site on; defaults to 8000")
+    parser.add_argument("-b", "--bind", default="localhost", help="the address to serve the site on; defaults to localhost")
+    parser.add_argument("-l", "--livereload", action="store_true", help="reloads open pages in the browser after each rebuild")
+    
+    args = checkArgs(vars(parser.parse_args(argv)))
+    args["cache"] = True #rebuilds are always incremental
+    
+    env = setupSite(**args)
+    serveSite(env, args["bind"], args["port"], args["livereload"])
+    
+def backends(argv):
+    from .build import setupSite
+    from .backends import BACKENDS, compareBackends, summariseTimings
+    
+    parser = argparse.ArgumentParser(prog="trakai backends", description="compares how long each installed markdown backend takes to convert the posts of a site")
+    parser.add_argument("path", nargs="?", default=os.getcwd(), type=checkDir, help="the path of the site; defaults to the current directory")
+    parser.add_argument("-c", "--config", default="resources/trakai.json", help="specifies an alternate location for configuration files")
+    parser.add_argument("-r", "--repeat", default=3, type=int, help="the number of times each post is converted; the fastest time is kept")
+    parser.add_argument("-b", "--backend", action="append", choices=list(BACKENDS), help="a backend to compare; defaults to every installed backend")
+    
+    args = vars(parser.parse_args(argv))
+    env = setupSite(**args, silent=True, cache=False, nocache=True, build=False)
+    
+    with os.scandir(env.globals["posts_path"]) as folder:
+        files = sorted(item.path for item in folder if item.name.endswith((".md", ".markdown")))
+        
+    results = compareBackends(env, files, args["backend"], args["repeat"])
+    
+    print("{:<14}{:>12}{:>12}{:>12}{:>12}".format("backend", "total (ms)", "mean (ms)", "median (ms)", "max (ms)"))
+    for backend, timings in results.items():
+        summary = summariseTimings(timings)
+        print("{:<14}{:>12.2f}{:>12.3f}{:>12.3f}{:>12.3f}".format(backend, *(summary[k] * 1000 for k in ("total", "mean", "median", "max"))))
+    
+def merge(argv):
+    from .build import setupSite
+    
+    parser = argparse.ArgumentParser(prog="trakai merge", description="renders the lists, feed, archive, tags and preview of a site from the artifacts written by trakai --shard, without reading any posts")
+    addBuildArguments(parser)
+    
+    args = checkArgs(vars(parser.parse_args(argv)))
+    setupSite(**args, merge=True)
+    
+def getSize(path):
+    if os.path.isfile(path): return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(path) for name in files)
+    
+def cache(argv):
+    import time
+    from .build import setupSite
+    from .store import getStoreStats, vacuumStore
+    
+    parser = argparse.ArgumentParser(prog="trakai cache", description="inspects or compacts the build state kept between cached builds")
+    parser.add_argument("path", nargs="?", default=os.getcwd(), type=checkDir, help="the path of the site; defaults to the current directory")
+    parser.add_argument("-c", "--config", default="resources/trakai.json", help="specifies an alternate location for configuration files")
+    parser.add_argument("--stats", action="store_true", help="prints the number of entries and the size of each cache; the default")
+    parser.add_argument("--vacuum", action="store_true", help="compacts the build state store")
+    
+    args = vars(parser.parse_args(argv))
+    env = setupSite(path=args["path"], config=args["config"], silent=True, cache=False, nocache=True, build=False)
+    store = env.globals["cache_path"]
+    
+    if args["vacuum"]:
+        sizes = vacuumStore(store)
+        if sizes is None: print("trakai: no build state at " + store)
+        else: print("Vacuumed {}: {} => {} bytes".format(store, *sizes))
+        
+    if args["stats"] or not args["vacuum"]:
+        stats = getStoreStats(store)
+        
+        if stats is None: 
+            print("{:<16}{} (not created yet)".format("build state", store))
+        else:
+            last_build = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats["last_build"])) if stats["last_build"] else "never"
+            print("{:<16}{} (schema {}, {} bytes, {} free)".format("build state", store, stats["schema"], stats["size"], stats["free"]))
+            print("{:<16}{}".format("outputs", stats["outputs"]))
+            print("{:<16}{}".format("tags", stats["tags"]))
+            print("{:<16}{}".format("parsed posts", stats["posts"]))
+            print("{:<16}{}".format("fragments", stats["fragments"]))
+            print("{:<16}{}".format("indexed posts", stats["indexed"]))
+            print("{:<16}{}".format("last build", last_build))
+            
+        for name, key in (("prose", "prose_cache_path"), ("manifest", "manifest_path"), ("templates", "template_cache_path")):
+            path = env.globals[key]
+            print("{:<16}{} ({})".format(name, path, "{} bytes".format(getSize(path)) if os.path.exists(path) else "not created yet"))
+    
+def main():
+    if sys.argv[1:2] == ["serve"]: 
+        return serve(sys.argv[2:])
+    elif sys.argv[1:2] == ["backends"]: 
+        return backends(sys.argv[2:])
+    elif sys.argv[1:2] == ["cache"]: 
+        return cache(sys.argv[2:])
+    elif sys.argv[1:2] == ["merge"]: 
+        return merge(sys.argv[2:])
+    
+    parser = argparse.ArgumentParser(prog="trakai", description="a simple blog generator designed specially to integrate into existing sites")
+    addBuildArguments(parser)
+    parser.add_argument("-w", "--watch", action="store_true", help="keeps running after the build, and rebuilds the site whenever posts or templates change; implies --cache")
+    parser.add_argument("--shard", default=None, type=checkShard, metavar="i/N", help="renders only the post pages of shard i out of N, and writes their metadata for trakai merge")
+    
+    #the build is only imported once the arguments are parsed, so --version and --help stay fast
+    args = checkArgs(vars(parser.parse_args()))
+    if args["watch"]: args["cache"] = True
+    
+    from .build import setupSite
+        
+    env = setupSite(**args, fastpath=not args["watch"])
+    
+    if args["watch"]:
+        from .serve import watchSite
+        try: watchSite(env)
+        except KeyboardInterrupt: pass
     
 if __name__ == "__main__": main()
-
@@ -0,0 +1,153 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import re, time
+from .utils import fread, log
+
+#the same header format as the meta extension of Python-Markdown
+META_RE = re.compile(r"^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)")
+META_MORE_RE = re.compile(r"^[ ]{4,}(?P<value>.*)")
+BEGIN_RE = re.compile(r"^-{3}(\s.*)?")
+END_RE = re.compile(r"^(-{3}|\.{3})(\s.*)?")
+
+converters = {} #one converter per backend and set of extensions in each process
+
+def splitMeta(text):
+	#reads meta headers for backends that have no equivalent of the meta extension
+	meta, key = {}, None
+	lines = text.split("\n")
+
+	if lines and BEGIN_RE.match(lines[0]): lines.pop(0)
+
+	while lines:
+		line = lines.pop(0)
+		match = META_RE.match(line)
+
+		if line.strip() == "" or END_RE.match(line): break
+
+		if match:
+			key = match.group("key").lower().strip()
+			meta.setdefault(key, []).append(match.group("value").strip())
+		elif META_MORE_RE.match(line) and key:
+			meta[key].append(META_MORE_RE.match(line).group("value").strip())
+		else:
+			lines.insert(0, line)
+			break
+
+	return meta, "\n".join(lines)
+
+def makeMarkdown(extensions):
+	import markdown
+	md = markdown.Markdown(extensions=extensions)
+
+	def convert(text):
+		md.reset()
+		html = md.convert(text)
+		return html, getattr(md, "Meta", {})
+	return convert
+
+def makeMarkdownIt(extensions):
+	from markdown_it import MarkdownIt
+	md = MarkdownIt("commonmark")
+	if "tables" in extensions: md.enable("table")
+
+	def convert(text):
+		meta, text = splitMeta(text) if "meta" in extensions else ({}, text)
+		return md.render(text), meta
+	return convert
+
+def makeMistune(extensions):
+	import mistune
+	plugins = [name for ext, name in (("tables", "table"), ("def_list", "def_list")) if ext in extensions]
+	md = mistune.create_markdown(plugins=plugins)
+
+	def convert(text):
+		meta, text = splitMeta(text) if "meta" in extensions else ({}, text)
+		return md(text), meta
+	return convert
+
+def makeCommonmark(extensions):
+	import commonmark
+	parser, renderer = commonmark.Parser(), commonmark.HtmlRenderer()
+
+	def convert(text):
+		meta, text = splitMeta(text) if "meta" in extensions else ({}, text)
+		return renderer.render(parser.parse(text)), meta
+	return convert
+
+BACKENDS = {
+	"markdown": makeMarkdown,
+	"markdown-it": makeMarkdownIt,
+	"mistune": makeMistune,
+	"commonmark": makeCommonmark,
+}
+
+def getConverter(env, backend=None):
+	#converters are built once and reused for every document. each returns the html
+	#and the meta headers of a document, as lists of lines like Markdown.Meta
+	backend = backend or env.globals["markdown_backend"]
+	key = (backend, tuple(env.globals["markdown_extensions"]))
+
+	if key not in converters:
+		if backend not in BACKENDS:
+			raise ValueError("unknown markdown backend '{}', expected one of: {}".format(backend, ", ".join(BACKENDS)))
+
+		try:
+			converters[key] = BACKENDS[backend](env.globals["markdown_extensions"])
+		except ImportError as e:
+			if backend == "markdown": raise
+			log(env,"WARNING: Markdown backend {} is not installed, using markdown instead: {}", backend, str(e))
+			converters[key] = getConverter(env, "markdown")
+
+	return converters[key]
+
+def compareBackends(env, filenames, backends=None, repeat=3):
+	#times each installed backend on each document, keeping the best of several runs.
+	#returns the timings in seconds for each backend, in the same order as filenames
+	results = {}
+	texts = [fread(filename) for filename in filenames]
+
+	for backend in backends or BACKENDS:
+		try: convert = BACKENDS[backend](env.globals["markdown_extensions"])
+		except ImportError: continue
+
+		timings = []
+		for text in texts:
+			best = None
+			for i in range(repeat):
+				start = time.perf_counter()
+				convert(text)
+				elapsed = time.perf_counter() - start
+				best = elapsed if best is None else min(best, elapsed)
+			timings.append(best)
+
+		results[backend] = timings
+
+	return results
+
+def summariseTimings(timings):
+	import statistics
+	return {
+		"total": sum(timings),
+		"mean": statistics.mean(timings) if timings else 0,
+		"median": statistics.median(timings) if timings else 0,
+		"max": max(timings) if timings else 0
+	}
@@ -19,15 +19,24 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import os, json, datetime, shutil
+import os, sys, json, hashlib, datetime, shutil
 from os import path
-from jinja2 import Environment, FileSystemLoader
-from .output import makePages, makeList, makePaginatedList, insertPreview, getTaggedPosts
-from .utils import fread, log
+from functools import partial
+from .output import RUNTIME_PARAMS, makePages, listPosts, readPosts, renderPosts, makeList, makePaginatedList, makeArchive, insertPreview, getTaggedPosts, getPages, checkTagIndex, initCache, updateCache, initManifest, updateManifest, initFragments, renderFragment, updateFragments, initWriter, prepareDirs, flushOutputs, closeWriter, writeShard, readShards, initSearch, writeSearchIndex, updateSearch
+from .parsing import initParseCache, updateParseCache
+from .profiling import initProfile, span, writeProfile
+from .utils import fread, fwrite, log, scanSources, getSitePath
 from .version import __version__
 
-def setupSite(**args):
-	os.chdir(args["path"])
+PACKAGED_TEMPLATES = path.join(path.dirname(__file__), "templates")
+
+#params that name build inputs and state. they are made absolute when the site is loaded,
+#whereas outputs stay relative to the site, as they also give the paths of pages
+PATH_PARAMS = ("posts_path", "templates_path", "backup_path", "cache_path", "prose_cache_path", "manifest_path", 
+	"shard_path", "template_cache_path", "profile_path")
+
+def loadParams(**args):
+	site_path = path.abspath(args["path"])
 	
 	# default parameters
 	params = {
@@ -42,19 +51,43 @@ def setupSite(**args):
 		"has_pagination": False,
 		"has_tag_pagination": False,
 		"page_limit": 5,
+		"markdown_backend": "markdown",
 		"markdown_extensions": ["def_list","admonition","tables"], #meta is always loaded, see below
 		"has_preview": False,
 		"preview_class": None,
+		"preview_pages": ["index.html"],
+		"backup_limit": 10,
 		"has_archive": False,
+		"archive_period": None,
 		"has_tags": False,
 		"has_feed": True,
+		"feed_limit": None,
 		"has_caching": False,
-		"cache_path": "resources/backup/trakai_cache.json",
+		"cache_path": "resources/backup/trakai_cache.db",
+		"prose_cache_path": "resources/backup/prose",
+		"manifest_path": "resources/backup/trakai_manifest.json",
+		"build_workers": 1,
+		"write_workers": 4,
+		"write_queue": 64,
+		"write_fsync": False,
+		"has_minify": False,
+		"has_gzip": False,
+		"gzip_level": 9,
+		"has_search": False,
+		"search_prefix_length": 2,
+		"shard": None,
+		"shard_path": "resources/shards",
+		"merge_shards": False,
+		"has_template_cache": True,
+		"precompile_templates": False,
+		"template_cache_path": "resources/backup/templates",
+		"profile_path": None,
+		"profile_hook": None,
 	}
 	
-	# if params.json exists, load it
-	if path.isfile(args["config"]):
-		with open(args["config"], "r") as file: 
+	# if params.json exists, load it. a relative config is found from the site
+	if path.isfile(path.join(site_path, args["config"])):
+		with open(path.join(site_path, args["config"]), "r") as file: 
 			params.update(json.load(file))
 	
 	params["markdown_extensions"].append("meta") #meta should always be loaded
@@ -62,7 +95,7 @@ def setupSite(**args):
 	#add non-configurable global values. this uses the same object to save memory/effort,
 	#though a bespoke solution may be a good future addition
 	params.update({
-		"site_path": args["path"],
+		"site_path": site_path,
 		"__silent": args["silent"]
 	})
 	
@@ -71,50 +104,306 @@ def setupSite(**args):
 		params["has_caching"] = True
 	elif not args["nocache"]:
 		params["has_caching"] = False
+	
+	#override worker count and profiling if set in args
+	if args.get("jobs") is not None:
+		params["build_workers"] = args["jobs"]
+	if args.get("profile") is not None:
+		params["profile_path"] = args["profile"]
+	if args.get("profile_hook") is not None:
+		params["profile_hook"] = args["profile_hook"]
+		
+	#shards and merges keep their own build state, so that they can run side by side on 
+	#the same site, and so that a merge never removes post pages written by shards
+	if args.get("shard") is not None:
+		params["shard"] = list(args["shard"])
+	if args.get("merge"):
+		params["merge_shards"] = True
+		
+	if params["shard"] or params["merge_shards"]:
+		suffix = "shard-{}-of-{}".format(*params["shard"]) if params["shard"] else "merge"
+		for key in ("cache_path", "prose_cache_path", "manifest_path"):
+			base, ext = path.splitext(params[key])
+			params[key] = "{}.{}{}".format(base, suffix, ext)
+			
+	for key in PATH_PARAMS:
+		if params[key]: params[key] = path.normpath(path.join(site_path, params[key]))
+	
+	return params
+	
+def setupSite(**args):
+	#the working directory is still changed for callers that expect it, although the 
+	#build itself resolves every path against the site, see Site below. a relative site
+	#path is resolved first, as it is relative to the old working directory
+	args["path"] = path.abspath(args["path"])
+	os.chdir(args["path"])
+	params = loadParams(**args)
+	
+	#the fast path returns None, rather than the environment, before jinja or markdown are 
+	#imported. callers opt in with fastpath=True, as the command line does except in watch
+	#mode, so that library callers always get the environment back. it is never taken 
+	#when profiling
+	if params["has_caching"] and args.get("build", True) and args.get("fastpath", False) and not params["profile_path"]:
+		manifest = checkSources(params)
+		
+		if manifest is not None:
+			#the manifest lists no writes, as this build made none
+			if manifest.get("written") or manifest.get("removed"):
+				fwrite(params["manifest_path"], json.dumps({ **manifest, "written": [], "removed": [] }))
+			if not params["__silent"]: 
+				sys.stderr.write("Nothing changed since the last build ...\n")
+			return None
 			
-	# set up Jinja, and load layouts.
+	env = createEnvironment(params)
+	
+	#callers that only need the configured environment can skip the build
+	if not args.get("build", True): 
+		return env
+	
+	# create a new blog directory from scratch if there is no manifest of a previous build.
+	# otherwise, unchanged files are left alone and stale ones are removed after the build
+	if path.isdir(getSitePath(params, params["output_path"])) and not env.globals["has_caching"] and not path.isfile(env.globals["manifest_path"]) \
+		and not env.globals["shard"] and not env.globals["merge_shards"]: 
+		shutil.rmtree(getSitePath(params, params["output_path"]))
+	
+	#finally, generate site content
+	generateSite(env)
+	return env
+	
+class Site:
+	#a site kept in memory between builds, for callers that change a few posts at a time.
+	#parsed posts, the build graph and the tag index stay resident, so that update and 
+	#remove only render the outputs their posts affect. paths are resolved against the 
+	#site, and the working directory is left alone
+	def __init__(self, path, config="resources/trakai.json", silent=True, **args):
+		#the resident state is only checked through the cache, so it cannot be turned off
+		for key in ("cache", "nocache"):
+			if key in args: raise TypeError("Site always builds with the cache, got {}={!r}".format(key, args[key]))
+			
+		self.params = loadParams(**args, path=path, config=config, silent=silent, cache=True, nocache=True)
+		self.env = createEnvironment(self.params)
+		self.posts = None
+		
+	def build(self):
+		#reads every post and renders what changed since the last build. like update and
+		#remove, returns the files written, relative to the site
+		self.posts = readPosts(self.env, listPosts(self.env, self.params["posts_path"]))
+		return self.render()
+		
+	def update(self, paths):
+		#paths are relative to the site or absolute. posts that no longer exist are removed,
+		#and other files, such as templates, are picked up by the build graph
+		if self.posts is None: return self.build()
+		files = [file for file in map(self.getPost, paths) if file is not None]
+		
+		self.posts.update(readPosts(self.env, [(file, os.stat(file)) for file in files if path.isfile(file)]))
+		for file in files:
+			if not path.isfile(file): self.posts.pop(file, None)
+			
+		return self.render()
+		
+	def remove(self, paths):
+		#without a build yet, the posts are read without rendering, so the first render 
+		#already leaves the removed posts out
+		if self.posts is None:
+			self.posts = readPosts(self.env, listPosts(self.env, self.params["posts_path"]))
+		
+		for file in map(self.getPost, paths): 
+			self.posts.pop(file, None)
+			
+		return self.render()
+		
+	def getPost(self, filename):
+		#the key a post is kept under, or None if filename is not a post
+		filename = path.normpath(path.join(self.params["site_path"], filename))
+		
+		if path.dirname(filename) != self.params["posts_path"] or path.basename(filename) == ".DS_Store": 
+			return None
+		return filename
+		
+	def render(self):
+		#the parse cache keeps the entries of every resident post, not just those read now
+		updateParseCache(self.env, initParseCache(self.env), self.posts)
+		generateSite(self.env, list(self.posts.values()))
+		return list(self.env.globals["__manifest"]["last"]["written"])
+	
+def getSourcesKey(params):
+	#the version and configuration of a build. all_tags is left out, as it is set by
+	#the build itself and follows from the posts anyway
+	config = { k: v for k, v in params.items() if not k.startswith("__") and k not in RUNTIME_PARAMS and k != "all_tags" }
+	return hashlib.md5(json.dumps([__version__, config], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+	
+def checkSources(params):
+	#nothing needs building if the configuration, posts, templates and preview host pages
+	#are as they were when the last manifest was written, and all of its outputs exist.
+	#returns the manifest if so
+	if not path.isfile(params["manifest_path"]): return None
+	
+	with open(params["manifest_path"], "r") as file: 
+		manifest = json.load(file)
+		
+	sources = manifest.get("sources")
+	if not sources or sources["key"] != getSourcesKey(params): return None
+	if scanSources([params["posts_path"], params["templates_path"]]) != sources["files"]: return None
+	
+	for page in (params["preview_pages"] if params["has_preview"] else []):
+		state = manifest.get("previews", {}).get(page)
+		if not state or not path.isfile(getSitePath(params, page)): return None
+		
+		stat = os.stat(getSitePath(params, page))
+		if [stat.st_mtime_ns, stat.st_size] != state["stat"]: return None
+		
+	if not all(path.isfile(getSitePath(params, dst)) for dst in manifest.get("files", {})): return None
+	return manifest
+	
+def precompileTemplates(params):
+	#packaged templates only change between releases, so they are compiled once
+	#per trakai and jinja version and imported from then on
+	import jinja2, tempfile
+	from jinja2 import Environment, FileSystemLoader
+	from .loaders import PackagedLoader
+	
+	target = path.join(params["template_cache_path"], "trakai-{}-jinja-{}".format(__version__, jinja2.__version__))
+	
+	if not path.isdir(target):
+		os.makedirs(params["template_cache_path"], exist_ok=True)
+		temp = tempfile.mkdtemp(dir=params["template_cache_path"])
+		Environment(loader=FileSystemLoader(PACKAGED_TEMPLATES), autoescape=False).compile_templates(temp, zip=None)
+		
+		try: os.rename(temp, target)
+		except OSError: shutil.rmtree(temp) #compiled at the same time by another process
+		
+	return PackagedLoader(target, PACKAGED_TEMPLATES)
+
+def createEnvironment(params):
+	# set up Jinja, and load layouts. jinja is imported here rather than with the module,
+	# so that builds that take the fast path in setupSite never load it
+	from jinja2 import Environment, FileSystemLoader, ChoiceLoader, FileSystemBytecodeCache
+	
+	packaged = precompileTemplates(params) if params["precompile_templates"] else FileSystemLoader(PACKAGED_TEMPLATES)
+	bytecode_cache = None
+	
+	#compiled templates are cached on disk. jinja checks the source of each 
+	#template against the cached copy, so edited templates are recompiled
+	if params["has_template_cache"]:
+		os.makedirs(params["template_cache_path"], exist_ok=True)
+		bytecode_cache = FileSystemBytecodeCache(params["template_cache_path"])
+	
 	env = Environment(
-		loader = FileSystemLoader([
-			params["templates_path"],
-			path.dirname(__file__) + "/templates/"
+		loader = ChoiceLoader([
+			FileSystemLoader(params["templates_path"]),
+			packaged
 		]),
+		bytecode_cache = bytecode_cache,
 		autoescape = False
 	)
 	env.globals = params 
+	env.filters["fragment"] = partial(renderFragment, env)
+	return env
+	
+def generateSite(env, posts=None):
+	initProfile(env)
+	initManifest(env)
+	if env.globals["has_caching"]: 
+		initCache(env)
+		
+		#sources are recorded before the build, so that edits made during it are picked up next time
+		env.globals["__sources"] = { 
+			"key": getSourcesKey(env.globals), 
+			"files": scanSources([env.globals["posts_path"], env.globals["templates_path"]]) 
+		}
+	initFragments(env)
+	initSearch(env)
+	initWriter(env)
 	
-	# create a new blog directory from scratch, and create blog posts
-	if path.isdir(env.globals["output_path"]) and not env.globals["has_caching"]: 
-		shutil.rmtree(env.globals["output_path"])
+	#outputs are written in the background, so the build waits for them before
+	#the manifest is updated. the writer threads are stopped even if the build fails
+	try:
+		posts = renderSite(env, posts)
+		with span(env, "flushOutputs"):
+			flushOutputs(env)
+	finally:
+		closeWriter(env)
 	
-	#finally, generate site content
-	generateSite(env)
-	return env
+	#the search index is committed first, as its transaction holds the store until then
+	with span(env, "updateSearch"):
+		updateSearch(env)
+	with span(env, "updateFragments"):
+		updateFragments(env, posts)
+	with span(env, "updateManifest"):
+		updateManifest(env)
+	if env.globals["has_caching"]: 
+		with span(env, "updateCache"):
+			updateCache(env)
 	
-def generateSite(env):
+	if "__profile" in env.globals: 
+		writeProfile(env)
+				
+	return posts
+	
+def renderSite(env, posts=None):
 	feed_path = path.join(env.globals["output_path"],"feed.xml")
 	archive_path = path.join(env.globals["output_path"],"archive.html")
-	posts = makePages(env,env.globals["posts_path"], path.join(env.globals["output_path"],"posts"), "post.html")
+	
+	#a shard renders its share of the post pages and writes their metadata, which a
+	#merge then reads in place of the posts to render everything else
+	if env.globals["merge_shards"]:
+		with span(env, "readShards"):
+			posts = readShards(env)
+	elif posts is not None:
+		#posts kept in memory by a Site are already parsed, and only need rendering
+		with span(env, "makePages"):
+			posts = renderPosts(env, posts, path.join(env.globals["output_path"],"posts"), "post.html")
+	else:
+		with span(env, "makePages"):
+			posts = makePages(env,env.globals["posts_path"], path.join(env.globals["output_path"],"posts"), "post.html")
+			
+	if env.globals["shard"]:
+		with span(env, "writeShard"):
+			writeShard(env, posts)
+		return posts
+		
+	if "__search" in env.globals:
+		with span(env, "search"):
+			writeSearchIndex(env, posts, path.join(env.globals["output_path"],"search"))
 	    
 	if env.globals["has_pagination"]: 
-		makePaginatedList(env, posts, env.globals["output_path"], "list.html", page_mode="regular")
+		with span(env, "makePaginatedList"):
+			makePaginatedList(env, posts, env.globals["output_path"], "list.html", page_mode="regular")
 	else: 
-		makeList(env,posts,path.join(env.globals["output_path"],"index.html"), "list.html", page_mode="regular")
+		with span(env, "makeList"):
+			makeList(env,posts,path.join(env.globals["output_path"],"index.html"), "list.html", page_mode="regular")
 
 	if env.globals["has_feed"]: 
-		makeList(env,posts,feed_path,"feed.xml",page_mode="feed")
+		with span(env, "feed"):
+			makeList(env,posts[:env.globals["feed_limit"]] if env.globals["feed_limit"] else posts,feed_path,"feed.xml",page_mode="feed")
 		
 	if env.globals["has_archive"]: 
-		makeList(env,posts,archive_path, "list.html", page_mode="archive")
+		with span(env, "archive"):
+			if env.globals["archive_period"]:
+				makeArchive(env,posts,archive_path, "list.html")
+			else:
+				makeList(env,posts,archive_path, "list.html", page_mode="archive")
 		
 	if env.globals["has_preview"]: 
-		insertPreview(env,posts[0],"index.html","excerpt.html")
+		with span(env, "insertPreview"):
+			for page in env.globals["preview_pages"]:
+				insertPreview(env,posts[0],page,"excerpt.html")
 	
 	if env.globals["has_tags"]:
-		tags = getTaggedPosts(env,posts)
-		for tag in tags:
-			if env.globals["has_tag_pagination"]: 
-				 makePaginatedList(env, tags[tag], path.join(env.globals["output_path"],"tags/{}/".format(tag.lower())), "list.html", page_mode="tags", current_tag=tag)
-			else:  
-				makeList(env, tags[tag], path.join(env.globals["output_path"],"tags/{}.html".format(tag.lower())), "list.html", page_mode="tags", current_tag=tag)
+		with span(env, "tags"):
+			tags = getTaggedPosts(env,posts)
+			if tags and not env.globals["has_tag_pagination"]: 
+				prepareDirs(env, [path.join(env.globals["output_path"],"tags")])
 				
+			for tag in tags:
+				if env.globals["has_tag_pagination"]: 
+					dst = path.join(env.globals["output_path"],"tags/{}/".format(tag.lower()))
+					if not checkTagIndex(env, tag, tags[tag], "list.html", getPages(env, tags[tag], dst)):
+						makePaginatedList(env, tags[tag], dst, "list.html", page_mode="tags", current_tag=tag)
+				else:  
+					dst = path.join(env.globals["output_path"],"tags/{}.html".format(tag.lower()))
+					if not checkTagIndex(env, tag, tags[tag], "list.html", [dst]):
+						makeList(env, tags[tag], dst, "list.html", page_mode="tags", current_tag=tag)
+	
 	return posts
@@ -0,0 +1,37 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+from jinja2 import FileSystemLoader, ModuleLoader
+
+#jinja is only imported once an environment is created, see createEnvironment in build.py
+
+class PackagedLoader(ModuleLoader):
+	#loads the packaged templates from precompiled modules, but still exposes 
+	#their source so that dependencies can be tracked
+	has_source_access = True
+	
+	def __init__(self, target, source):
+		super().__init__(target)
+		self.source_loader = FileSystemLoader(source)
+		
+	def get_source(self, environment, template):
+		return self.source_loader.get_source(environment, template)
@@ -19,68 +19,694 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import os, time, math, html, json, hashlib
-from html.parser import HTMLParser
-from .parsing import readContent
-from .utils import log, fread, fwrite
-
-def checkCache(env,cache,content):	
-	name = content["name"]
-	hash = hashlib.md5(str(content).encode("utf-8")).hexdigest()
-	path = content["path"][1:]
-	
-	if name in cache and cache[name] == hash and os.path.isfile(path): 
-		log(env,"Rendering skipped for {} (cached) ...", path)
-		return True
+import os, re, time, math, html, json, queue, hashlib, datetime, itertools, threading
+from collections import deque
+from functools import partial
+from .parsing import Post, readContent, initParseCache, checkParseCache, storeParseCache, updateParseCache
+from .postprocess import minifyStream, writeGzip
+from .search import countTerms, getPrefix
+from .profiling import span, count, newProfile, drainProfile, mergeProfile
+from .utils import log, fread, fwrite, fstream, getSitePath
+from .version import __version__
+
+worker_env = None #environment of a worker process, see initWorker
+TAG_RE = re.compile(r"(?P<skip><!--.*?-->|<(script|style)\b.*?</\2\s*>)|<(?P<closing>/?)(?P<name>[a-zA-Z][^\s/>]*)(?P<attrs>[^>]*)>", re.S | re.I)
+CLASS_RE = re.compile(r"""\bclass\s*=\s*("([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.I)
+FRAGMENT_RE = re.compile(r"""\bfragment\s*\(\s*(["'])(.+?)\1""") #layouts used through the fragment filter
+WRITE_BUFFER = 1 << 16 #the largest output handed to the writer threads whole, in characters
+RUNTIME_PARAMS = ("build_workers", "write_workers", "write_queue", "write_fsync", "profile_path", "profile_hook") #params that never affect the output
+
+def getTemplateDeps(env, name):
+	#the template itself and every template reached through extends, include or import,
+	#or rendered through the fragment filter, which jinja does not see as a reference
+	from jinja2 import meta
+	graph = env.globals["__graph"]
+	
+	if name not in graph["templates"]:
+		deps, pending = {}, [name]
+		
+		while pending:
+			current = pending.pop()
+			if current in deps: continue
+			
+			source = env.loader.get_source(env, current)[0]
+			deps[current] = hashlib.md5(source.encode("utf-8")).hexdigest()
+			if "all_tags" in source: graph["tag_templates"].add(current)
+			pending.extend(t for t in meta.find_referenced_templates(env.parse(source)) if t)
+			pending.extend(match.group(2) for match in FRAGMENT_RE.finditer(source))
+			
+		graph["templates"][name] = deps
+		
+	return graph["templates"][name]
+	
+def getPostHash(env, post):
+	graph = env.globals["__graph"]
+	
+	if post["name"] not in graph["posts"]:
+		graph["posts"][post["name"]] = post.getHash() if isinstance(post, Post) else hashlib.md5(str(post).encode("utf-8")).hexdigest()
+	return graph["posts"][post["name"]]
+	
+def getGlobalsHash(env):
+	graph = env.globals["__graph"]
 	
-	cache[name] = hash
+	if graph["globals"] is None:
+		params = { k: v for k, v in env.globals.items() if not k.startswith("__") and k not in RUNTIME_PARAMS and k != "all_tags" }
+		graph["globals"] = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+	return graph["globals"]
+	
+def getTagsParam(env, templates):
+	#all_tags is left out of the globals hash, as a new tag would otherwise render every
+	#output again. only outputs with a template that reads it depend on it
+	if any(name in env.globals["__graph"]["tag_templates"] for name in templates): 
+		return env.globals.get("all_tags")
+	return None
+
+def checkCache(env, dst, layout, posts, params):
+	#an output is up to date if its templates, posts, page parameters and the site 
+	#configuration all hash the same as when it was last written
+	graph = env.globals.get("__graph")
+	if graph is None: return False
+	
+	templates = getTemplateDeps(env, layout)
+	entry = {
+		"posts": [post["name"] for post in posts],
+		"templates": sorted(templates),
+		"hash": hashlib.md5(json.dumps([
+			templates,
+			[getPostHash(env, post) for post in posts],
+			params,
+			getGlobalsHash(env),
+			getTagsParam(env, templates)
+		], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+	}
+	
+	old = graph["old"].get(dst)
+	graph["outputs"][dst] = entry
+	
+	if isinstance(old, dict) and old.get("hash") == entry["hash"] and os.path.isfile(getSitePath(env.globals, dst)): 
+		log(env,"Rendering skipped for {} (cached) ...", dst)
+		count(env, "output_cache_hits")
+		keepOutput(env, dst)
+		return True
+		
+	count(env, "output_cache_misses")
 	return False
 	
-def initCache(path):
-	if not os.path.isfile(path):
-		fwrite(path,"")
-		return {}
-	with open(path, "r") as file: 
-		return json.load(file)
+def initCache(env):
+	#long-lived environments (see serve.py) keep the graph in memory between builds
+	if "__graph" in env.globals: return
+	
+	from .store import loadStore
+	outputs, tags = loadStore(env.globals["cache_path"])
+	env.globals["__graph"] = { 
+		"old": outputs, 
+		"outputs": {}, 
+		"old_tags": tags, 
+		"tags": {}, 
+		"templates": {}, 
+		"tag_templates": set(),
+		"posts": {}, 
+		"globals": None 
+	}
+		
+def updateCache(env):
+	#only outputs and tags produced by this build are kept. the manifest normally removes
+	#evicted outputs already, but not if it was deleted since the last build
+	from .store import saveStore
+	graph = env.globals["__graph"]
+	output_path = os.path.normpath(env.globals["output_path"]) + os.sep
+	
+	for dst in saveStore(env.globals["cache_path"], graph["old"], graph["outputs"], graph["old_tags"], graph["tags"]):
+		if os.path.normpath(dst).startswith(output_path) and os.path.isfile(getSitePath(env.globals, dst)): 
+			removeOutput(env, dst)
+	
+	graph.update(old=graph["outputs"], outputs={}, old_tags=graph["tags"], tags={}, templates={}, tag_templates=set(), posts={}, globals=None)
+	
+def checkTagIndex(env, tag, posts, layout, outputs):
+	#the tag index maps each tag to its posts and pages. a tag whose posts, templates
+	#and configuration are unchanged keeps its pages without going through makeList
+	graph = env.globals.get("__graph")
+	if graph is None: return False
+	
+	entry = {
+		"posts": [post["name"] for post in posts],
+		"outputs": outputs,
+		"hash": hashlib.md5(json.dumps([
+			getTemplateDeps(env, layout),
+			[getPostHash(env, post) for post in posts],
+			getGlobalsHash(env),
+			getTagsParam(env, getTemplateDeps(env, layout))
+		], sort_keys=True).encode("utf-8")).hexdigest()
+	}
+	
+	old = graph["old_tags"].get(tag)
+	graph["tags"][tag] = entry
+	
+	if old != entry or not all(dst in graph["old"] and os.path.isfile(getSitePath(env.globals, dst)) for dst in outputs): 
+		count(env, "tag_index_misses")
+		return False
+		
+	for dst in outputs:
+		graph["outputs"][dst] = graph["old"][dst]
+		keepOutput(env, dst)
 		
-def updateCache(cache,path):
-	with open(path, "w") as file: 
-		json.dump(cache,file)
+	log(env,"Rendering skipped for tag {} (unchanged) ...", tag)
+	count(env, "tag_index_hits")
+	return True
 
-def makePages(env, src, dst, layout):
-	items = []
-	tags = set([])
-	temp = env.get_template(layout)
-	cache = initCache(env.globals["cache_path"]) if env.globals["has_caching"] else None
+def initFragments(env):
+	#fragments are the entries that lists render for each post. with caching on they are
+	#kept in the store, and only their hashes are loaded up front. without caching they 
+	#only last for the build, as without the build graph there is nothing to check them against
+	if not env.globals["has_caching"]:
+		env.globals.setdefault("__fragments", { "db": None, "old": {}, "fragments": {} })
+		return
+		
+	from .store import openStore, loadFragments
+	db = openStore(env.globals["cache_path"])
 	
-	# Load layouts.
-	with os.scandir(src) as folder:
-		for item in folder:
-			if not item.is_file() or item.name == ".DS_Store": continue
+	#long-lived environments (see serve.py) keep the hashes in memory between builds
+	if "__fragments" not in env.globals:
+		env.globals["__fragments"] = { "old": loadFragments(db), "fragments": {} }
+	env.globals["__fragments"]["db"] = db
+
+def renderFragment(env, post, layout):
+	#the fragment filter, as in {{ item | fragment("entry.html") }}. each post is rendered
+	#once per build and layout however many lists it is in, and reused across builds
+	#while its hash, the layout and the configuration are unchanged. fragments only see
+	#the post as item and the site configuration, not the parameters of the list
+	fragments = env.globals.get("__fragments")
+	if fragments is None: return env.get_template(layout).render(item=post)
+
+	key = "{}:{}".format(layout, post["name"])
+	digest = hashlib.md5(json.dumps([
+		getTemplateDeps(env, layout),
+		getPostHash(env, post),
+		getGlobalsHash(env),
+		getTagsParam(env, getTemplateDeps(env, layout))
+	], sort_keys=True).encode("utf-8")).hexdigest() if "__graph" in env.globals else None
+
+	entry = fragments["fragments"].get(key)
+	
+	if entry is None and digest is not None and fragments["old"].get(key) == (post["name"], digest):
+		from .store import getFragment
+		entry = { "post": post["name"], "hash": digest, "html": getFragment(fragments["db"], key), "stored": True }
+
+	if entry is None or entry["hash"] != digest:
+		count(env, "fragment_cache_misses")
+		entry = { "post": post["name"], "hash": digest, "html": env.get_template(layout).render(item=post), "stored": False }
+	else:
+		count(env, "fragment_cache_hits")
+
+	fragments["fragments"][key] = entry
+	return entry["html"]
+
+def updateFragments(env, posts):
+	#only fragments rendered again are written. fragments of lists skipped by checkCache 
+	#are kept too, as long as their post exists
+	fragments = env.globals["__fragments"]
+	
+	if fragments["db"] is None:
+		fragments.update(old={}, fragments={})
+		return
+		
+	from .store import saveFragments
+	names = set(post["name"] for post in posts)
+	old = { key: value for key, value in fragments["old"].items() if value[0] in names }
+	
+	saveFragments(fragments["db"], 
+		{ key: entry for key, entry in fragments["fragments"].items() if not entry["stored"] },
+		[key for key in fragments["old"] if key not in old])
+	fragments["db"].close()
+	
+	old.update((key, (entry["post"], entry["hash"])) for key, entry in fragments["fragments"].items())
+	fragments.update(db=None, old=old, fragments={})
+
+def initSearch(env):
+	#the postings of each post are kept in the store with its hash, so only posts that
+	#changed are counted and indexed again. without caching the index only lasts for the
+	#build. shards and merges have no index, as neither sees the prose of every post
+	if not env.globals["has_search"] or env.globals["shard"] or env.globals["merge_shards"]: return
+	
+	from .store import openStore, loadSearch
+	#a build that failed leaves its index uncommitted, and closing it rolls it back
+	search = env.globals.pop("__search", None)
+	if search is not None: search["db"].close()
+	
+	db = openStore(env.globals["cache_path"] if env.globals["has_caching"] else ":memory:")
+	old, shards = loadSearch(db, env.globals["search_prefix_length"])
+	env.globals["__search"] = { "db": db, "old": old, "shards": shards, "changed": {}, "written": {}, "dropped": [] }
+	
+def indexPosts(env, posts):
+	#called by makePages while the prose of each post is still loaded
+	search = env.globals.get("__search")
+	if search is None: return
+	
+	for post in posts:
+		digest = post.getHash()
+		
+		if search["old"].get(post["name"], (None, None))[1] == digest or post["name"] in search["changed"]:
+			count(env, "search_index_hits")
+		else:
+			count(env, "search_index_misses")
+			search["changed"][post["name"]] = (digest, countTerms(post.get("title", "") + " " + post["prose"]))
+		
+def writeSearchIndex(env, posts, dst):
+	#writes the postings of each term prefix to its own shard, and a manifest of the shards 
+	#and documents. documents keep their ids between builds, so only the shards of prefixes 
+	#in the terms of changed or removed posts are rebuilt, and the others are kept as they are
+	from .store import updatePostings, getPostings
+	search = env.globals.get("__search")
+	if search is None: return
+	
+	length = env.globals["search_prefix_length"]
+	names = set(post["name"] for post in posts)
+	removed = { name: entry[0] for name, entry in search["old"].items() if name not in names }
+	ids = { name: entry[0] for name, entry in search["old"].items() if name in names }
+	next_id = max(ids.values(), default=-1) + 1
+	changed, shards = {}, search["shards"]
+	
+	for post in posts:
+		if post["name"] not in search["changed"]: continue
+		if post["name"] not in ids: 
+			ids[post["name"]] = next_id
+			next_id += 1
 			
-			content = readContent(env,item.path)
-			items.append(content)
-			if "tags" in content and env.globals["has_tags"]: tags.update(content["tags"])
+		digest, terms = search["changed"][post["name"]]
+		changed[post["name"]] = (ids[post["name"]], digest, [(getPrefix(term, length), term, tf) for term, tf in terms.items()])
 			
-		if env.globals["has_tags"]: 
-			env.globals["all_tags"] = sorted(tags)
+	touched = updatePostings(search["db"], changed, removed)
+	
+	for prefix in sorted(touched | set(shards)):
+		name = hashlib.md5(prefix.encode("utf-8")).hexdigest()[:12] + ".json"
+		
+		#shards missing from the output or the manifest are written again, even if untouched
+		kept = getDigests(env, os.path.join(dst, name))[0] is not None and os.path.isfile(getSitePath(env.globals, os.path.join(dst, name)))
+		if prefix not in touched and kept:
+			count(env, "search_shard_hits")
+			keepOutput(env, os.path.join(dst, name))
+			continue
+		
+		count(env, "search_shard_misses")
+		terms = getPostings(search["db"], prefix)
+		
+		if not terms:
+			shards.pop(prefix, None)
+			search["dropped"].append(prefix)
+			continue
 			
-		for content in items:			
-			content["path"] = os.path.join("/",dst,"{}.html".format(content["name"]))
+		text = json.dumps(terms, sort_keys=True, separators=(",", ":"))
+		shards[prefix] = search["written"][prefix] = { "file": name, "hash": hashlib.md5(text.encode("utf-8")).hexdigest()[:12] }
+		writeOutput(env, os.path.join(dst, name), [text])
+	
+	log(env,"Writing search index => {} ({} shards, {} rebuilt) ...", dst, len(shards), len(search["written"]))
+	writeOutput(env, os.path.join(dst, "manifest.json"), [json.dumps({
+		"prefix_length": length,
+		"documents": { ids[post["name"]]: { "path": post["path"], "title": post.get("title", ""), "date": post["date"] } for post in posts },
+		"shards": shards
+	}, sort_keys=True, separators=(",", ":"))])
+	
+def updateSearch(env):
+	#commits the postings and shards written by writeSearchIndex
+	from .store import saveShards
+	search = env.globals.get("__search")
+	if search is None: return
+	
+	saveShards(search["db"], search["written"], search["dropped"])
+	search["db"].close()
+	del env.globals["__search"]
+
+def initManifest(env):
+	#the manifest lists every file the last build emitted with its hash, along with 
+	#the files it wrote and removed, so deploy tooling can upload just the difference
+	old = {}
+	
+	#long-lived environments (see serve.py) keep the manifest in memory between builds
+	if "__manifest" in env.globals: return
+	
+	if os.path.isfile(env.globals["manifest_path"]):
+		with open(env.globals["manifest_path"], "r") as file: 
+			old = json.load(file)
 			
-			if env.globals["has_caching"] and checkCache(env,cache,content): 
-				continue
-				
-			output = temp.render(content)
+	env.globals["__manifest"] = { 
+		"old": old.get("files", {}), 
+		"files": {}, 
+		"written": [], 
+		"old_previews": old.get("previews", {}), 
+		"previews": {} 
+	}
+	
+def recordOutput(env, dst, digest, written):
+	manifest = env.globals.get("__manifest")
+	if manifest is None: return
+	
+	manifest["files"][dst] = digest
+	if written: manifest["written"].append(dst)
+	
+	if "__profile" in env.globals:
+		count(env, "files_written" if written else "files_unchanged")
+		count(env, "bytes_written", os.path.getsize(getSitePath(env.globals, dst)) if written else 0)
+	
+def keepOutput(env, dst):
+	#an output that is kept keeps its gzip sidecar too
+	manifest = env.globals.get("__manifest")
+	if manifest is None: return
+	
+	for path in (dst, dst + ".gz"):
+		if path in manifest["old"]: manifest["files"][path] = manifest["old"][path]
+		
+def getDigests(env, dst):
+	#the hashes an output and its sidecar had in the last build
+	manifest = env.globals.get("__manifest")
+	if manifest is None: return None, None
+	return manifest["old"].get(dst), manifest["old"].get(dst + ".gz")
+	
+def finishOutput(params, dst, chunks, digests, makedirs=True):
+	#writes an output, minified and with a gzip sidecar if enabled. only html, xml and json
+	#in output_path are processed, json being only compressed, and sidecars are only 
+	#written if the output changed.
+	#returns the path, hash and whether it was written for the output and its sidecar
+	digest, gz_digest = digests
+	target = getSitePath(params, dst)
+	processed = dst.endswith((".html", ".xml", ".json")) and os.path.normpath(dst).startswith(os.path.normpath(params["output_path"]) + os.sep)
+	
+	if processed and params["has_minify"] and not dst.endswith(".json"): 
+		chunks = minifyStream(chunks)
+		
+	digest, written = fstream(target, chunks, digest, params["write_fsync"], makedirs)
+	results = [(dst, digest, written)]
+	
+	if processed and params["has_gzip"]:
+		if written or gz_digest is None or not os.path.isfile(target + ".gz"):
+			results.append((dst + ".gz", writeGzip(target, params["gzip_level"], params["write_fsync"]), True))
+		else:
+			results.append((dst + ".gz", gz_digest, False))
+			
+	return results
+	
+def writeOutput(env, dst, chunks):
+	#outputs are rendered here, and written by the writer threads if there are any. only
+	#outputs up to WRITE_BUFFER go to the writers, so the queue holds no large documents,
+	#and larger ones, such as big lists, are streamed to disk here as they are rendered
+	writer = env.globals.get("__writer")
+	
+	if writer is not None:
+		chunks, head, size = iter(chunks), [], 0
+		
+		for chunk in chunks:
+			head.append(chunk)
+			size += len(chunk)
+			if size > WRITE_BUFFER: break
+		else:
+			collectOutputs(env)
+			writer["queue"].put((dst, "".join(head), getDigests(env, dst)))
+			return
+			
+		chunks = itertools.chain(head, chunks)
+	
+	for result in finishOutput(env.globals, dst, chunks, getDigests(env, dst)): 
+		recordOutput(env, *result)
+	
+def initWriter(env):
+	#rendered outputs go into a bounded queue, so rendering never gets more than 
+	#write_queue outputs ahead of the disk, and are written by write_workers threads
+	if not env.globals["write_workers"]: return
+	
+	writer = { 
+		"queue": queue.Queue(max(1, env.globals["write_queue"])), 
+		"dirs": set(), 
+		"results": deque(), 
+		"errors": deque(), 
+		"threads": [] 
+	}
+	
+	for i in range(env.globals["write_workers"]):
+		thread = threading.Thread(target=runWriter, args=(writer, env.globals), daemon=True)
+		thread.start()
+		writer["threads"].append(thread)
+		
+	env.globals["__writer"] = writer
+	
+def runWriter(writer, params):
+	while True:
+		job = writer["queue"].get()
+		
+		try:
+			if job is None: return
+			dst, text, digests = job
+			basedir = os.path.dirname(dst)
+			
+			if basedir not in writer["dirs"]:
+				if basedir: os.makedirs(getSitePath(params, basedir), exist_ok=True)
+				writer["dirs"].add(basedir)
+			
+			writer["results"].extend(finishOutput(params, dst, [text], digests, makedirs=False))
+		except Exception as e:
+			writer["errors"].append((job[0], e))
+		finally:
+			writer["queue"].task_done()
+			
+def prepareDirs(env, dirs):
+	#directories are created once up front, rather than checked for every output
+	writer = env.globals.get("__writer")
+	
+	for folder in dirs:
+		os.makedirs(getSitePath(env.globals, folder), exist_ok=True)
+		if writer is not None: writer["dirs"].add(folder)
+	
+def collectOutputs(env):
+	#records finished writes, and raises the first error of a writer thread in the build
+	writer = env.globals["__writer"]
+	
+	while writer["results"]: 
+		recordOutput(env, *writer["results"].popleft())
+		
+	if writer["errors"]:
+		dst, error = writer["errors"].popleft()
+		log(env,"ERROR: Writing {} failed", dst)
+		raise error
+	
+def flushOutputs(env):
+	#waits until every queued output is written
+	if env.globals.get("__writer") is None: return
+	
+	env.globals["__writer"]["queue"].join()
+	collectOutputs(env)
+	
+def closeWriter(env):
+	writer = env.globals.pop("__writer", None)
+	if writer is None: return
+	
+	for thread in writer["threads"]: writer["queue"].put(None)
+	for thread in writer["threads"]: thread.join()
+	
+def removeOutput(env, dst):
+	target = getSitePath(env.globals, dst)
+	os.remove(target)
+	log(env,"Removing stale output {} ...", dst)
+	
+	if os.path.isfile(target + ".gz"): os.remove(target + ".gz")
+	
+	if not os.listdir(os.path.dirname(target)): os.rmdir(os.path.dirname(target))
+	
+def updateManifest(env):
+	#outputs of the previous build that were not emitted again are stale. only files in 
+	#output_path are removed, so host pages such as the preview page are never deleted
+	manifest = env.globals["__manifest"]
+	output_path = os.path.normpath(env.globals["output_path"]) + os.sep
+	removed = []
+	
+	for dst in manifest["old"]:
+		if dst in manifest["files"] or not os.path.normpath(dst).startswith(output_path): continue
+		
+		if os.path.isfile(getSitePath(env.globals, dst)): removeOutput(env, dst)
+		removed.append(dst)
+	
+	fwrite(env.globals["manifest_path"], json.dumps({ 
+		"files": manifest["files"], 
+		"written": manifest["written"], 
+		"removed": removed,
+		"previews": manifest["previews"],
+		"sources": env.globals.get("__sources")
+	}))
+	manifest.update(old=manifest["files"], files={}, written=[], old_previews=manifest["previews"], previews={}, 
+		last={ "written": manifest["written"], "removed": removed })
 
-			log(env,"Rendering => {} ...", content["path"][1:])
-			fwrite(content["path"][1:], output)
+def initWorker(params):
+	global worker_env
+	from .build import createEnvironment
+	worker_env = createEnvironment(params)
+	
+def runWorker(func, item):
+	result = func(worker_env, item)
+	
+	if "__profile" in worker_env.globals: 
+		return result, drainProfile(worker_env)
+	return result
+	
+def getWorkerParams(env):
+	params = { k: v for k, v in env.globals.items() if k == "__silent" or not k.startswith("__") }
+	if "__profile" in env.globals: params["__profile"] = newProfile()
+	return params
+	
+def getWorkers(env):
+	workers = env.globals["build_workers"]
+	return workers if workers and workers > 0 else os.cpu_count() or 1
+	
+def mapPosts(env, func, items):
+	#runs func in worker processes if requested. map() keeps the input order,
+	#so the output is identical to a serial build
+	workers = getWorkers(env)
+	
+	if workers < 2 or len(items) < 2:
+		for item in items: yield func(env, item)
+		return
+		
+	#workers are not forked from the build, as the writer threads are running by then, and
+	#forking a process with threads can deadlock. they start from a clean process instead
+	import multiprocessing
+	from concurrent.futures import ProcessPoolExecutor
+	context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+	
+	with ProcessPoolExecutor(workers, mp_context=context, initializer=initWorker, initargs=(getWorkerParams(env),)) as pool:
+		for result in pool.map(partial(runWorker, func), items, chunksize=max(1, len(items) // (workers * 4))):
+			if "__profile" in env.globals:
+				result, (events, counters) = result
+				mergeProfile(env, events, counters)
+			yield result
+		
+def renderPage(layout, env, task):
+	content, digests = task
+	
+	with span(env, layout, "render", file=content["path"][1:]):
+		results = finishOutput(env.globals, content["path"][1:], env.get_template(layout).generate(content), digests)
+	
+	if isinstance(content, Post): content.evict()
+	return results
+
+def listPosts(env, src):
+	with os.scandir(src) as folder:
+		return [(item.path, item.stat()) for item in folder if item.is_file() and item.name != ".DS_Store" and inShard(env, item.name)]
+
+def readPosts(env, files):
+	#takes the (path, stat) pairs of posts, and returns them parsed by path. unchanged 
+	#posts are taken from the parse cache, and only the rest are parsed
+	parse_cache = initParseCache(env) if env.globals["has_caching"] else None
+	items = [checkParseCache(env, parse_cache, file, stat) if parse_cache else None for file, stat in files]
+	results = mapPosts(env, readContent, [file for (file, stat), content in zip(files, items) if content is None])
+	
+	for i, (file, stat) in enumerate(files):
+		if items[i] is None:
+			content = next(results)
+			items[i] = storeParseCache(env, parse_cache, file, content) if parse_cache else Post(content, content.pop("prose"))
 			
-	if env.globals["has_caching"]:
-		updateCache(cache,env.globals["cache_path"])
+	return { file: item for (file, stat), item in zip(files, items) }
+	
+def renderPosts(env, items, dst, layout):
+	tags = set([])
+	
+	for content in items:
+		if "tags" in content and env.globals["has_tags"]: tags.update(content["tags"])
+		
+	if env.globals["has_tags"]: 
+		env.globals["all_tags"] = sorted(tags)
+	
+	pending = []
+	
+	for content in items:			
+		content["path"] = os.path.join("/",dst,"{}.html".format(content["name"]))
+		
+		if checkCache(env, content["path"][1:], layout, [content], {}): 
+			continue
+		pending.append((content, getDigests(env, content["path"][1:])))
+	
+	prepareDirs(env, [dst])
+	
+	#worker processes write their own pages, otherwise they go through writeOutput
+	if getWorkers(env) < 2 or len(pending) < 2:
+		for content, digests in pending:
+			log(env,"Rendering => {} ...", content["path"][1:])
+			with span(env, layout, "render", file=content["path"][1:]):
+				writeOutput(env, content["path"][1:], env.get_template(layout).generate(content))
+			content.evict()
+	else:
+		for results in mapPosts(env, partial(renderPage, layout), pending):
+			log(env,"Rendering => {} ...", results[0][0])
+			for result in results: recordOutput(env, *result)
+	
+	indexPosts(env, items)
+	
+	#lists only need the metadata and summary of each post, so prose is dropped 
+	#once its page is written if it can be read back from the cache
+	for content in items: content.evict()
 
-	return sorted(items, key=lambda x: x["date"], reverse=True)
+	#posts with the same date are ordered by name, so that every host lists them alike
+	return sorted(sorted(items, key=lambda x: x["name"]), key=lambda x: x["date"], reverse=True)
+	
+def makePages(env, src, dst, layout):
+	posts = readPosts(env, listPosts(env, src))
+	
+	if env.globals["has_caching"]:
+		updateParseCache(env, env.globals["__parse_cache"])
+		
+	return renderPosts(env, list(posts.values()), dst, layout)
 
+def inShard(env, name):
+	#posts are assigned to shards by the hash of their file name, so every host agrees
+	#on the split without coordinating, and adding a post never moves the others
+	shard = env.globals["shard"]
+	if not shard: return True
+	return int(hashlib.md5(name.encode("utf-8")).hexdigest(), 16) % shard[1] == shard[0]
+	
+def writeShard(env, posts):
+	#the metadata of each post in the shard, without prose, which is all lists need
+	dst = os.path.join(env.globals["shard_path"], "shard-{}-of-{}.json".format(*env.globals["shard"]))
+	
+	log(env,"Writing shard => {} ...", dst)
+	writeOutput(env, dst, [json.dumps({
+		"version": __version__,
+		"shard": env.globals["shard"],
+		"posts": [{ k: post[k] for k in post if k != "prose" } for post in posts]
+	}, sort_keys=True)])
+	
+def readShards(env):
+	#combines the artifacts of every shard of a build. all shards of the same split must be
+	#present, so that a merge never renders lists with posts missing
+	shards = {}
+	
+	with os.scandir(env.globals["shard_path"]) as folder:
+		for item in folder:
+			match = re.fullmatch(r"shard-(\d+)-of-(\d+)\.json", item.name)
+			if match: shards.setdefault(int(match.group(2)), {})[int(match.group(1))] = item.path
+	
+	if len(shards) != 1:
+		raise ValueError("expected the shards of one build in {}, found splits into {}".format(env.globals["shard_path"], 
+			", ".join(str(n) for n in sorted(shards)) or "none"))
+			
+	total, files = next(iter(shards.items()))
+	missing = [str(i) for i in range(total) if i not in files]
+	if missing: 
+		raise ValueError("shards {} of {} are missing from {}".format(", ".join(missing), total, env.globals["shard_path"]))
+		
+	#shards carry no prose, so templates that read it fail rather than render nothing
+	posts = []
+	for i in range(total):
+		with open(files[i], "r") as file: 
+			for fields in json.load(file)["posts"]:
+				digest = hashlib.md5(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+				posts.append(Post(fields, None, digest, partial(missingProse, fields["name"])))
+			
+	if env.globals["has_tags"]:
+		env.globals["all_tags"] = sorted(set(tag for post in posts for tag in post.get("tags", [])))
+		
+	#the same order as makePages, so posts with the same date are listed alike on every host
+	log(env,"Merged {} posts from {} shards ...", len(posts), total)
+	return sorted(sorted(posts, key=lambda x: x["name"]), key=lambda x: x["date"], reverse=True)
+	
+def missingProse(name):
+	raise ValueError("the prose of {} is not available when merging shards, as shards only keep the metadata of posts. "
+		"templates rendered by a merge should use the summary instead".format(name))
+	
 def makeList(env, posts, dst, layout, **params):
 	temp = env.get_template(layout) 
 	   
@@ -90,18 +716,28 @@ def makeList(env, posts, dst, layout, **params):
 		"name": "blogindex",
 		**params
 	}
-	output = temp.render(page_params)
+	
+	if checkCache(env, dst, layout, posts, { k: v for k, v in page_params.items() if k != "posts" }):
+		return
 	
 	log(env,"Rendering list => {} ...", dst)
-	fwrite(dst, output)
+	with span(env, layout, "render", file=dst):
+		writeOutput(env, dst, temp.generate(page_params))
 	
-def makePaginatedList(env, posts, dst, layout, **params): 
-	i, r, pagenum = 0, 2, 1
+def getPages(env, posts, dst):
+	r = 2
 	pages = [os.path.join(dst,"index.html")]
 
 	while r <= math.ceil(len(posts) / env.globals["page_limit"]):
 		pages.append(os.path.join(dst,"pages","{}.html".format(r)))
 		r += 1
+		
+	return pages
+	
+def makePaginatedList(env, posts, dst, layout, **params): 
+	i, pagenum = 0, 1
+	pages = getPages(env, posts, dst)
+	prepareDirs(env, set(os.path.dirname(page) for page in pages))
 
 	while i < len(posts):
 		makeList(env,
@@ -117,37 +753,111 @@ def makePaginatedList(env, posts, dst, layout, **params):
 		i += env.globals["page_limit"]
 		pagenum += 1
 		
-def insertPreview(env, post, dst, layout):
-	class PreviewFinder(HTMLParser):
-		start, end, tag, nest = None, None, None, 0
+def getArchivePeriods(env, posts, dst):
+	#groups posts, which are newest first, by the year or month of their date. returns 
+	#the name, label and page of each period along with its posts
+	kind = env.globals["archive_period"]
+	if kind not in ("year", "month"): 
+		raise ValueError("archive_period must be year, month or null, not {}".format(kind))
 		
-		def handle_starttag(self, tag, attrs):
-			if env.globals["preview_class"] in self.getClasses(attrs): 
-				self.start = self.getpos()[0] - 1
-				self.tag = tag 
-				
-			elif tag == self.tag: self.nest += 1
+	periods = {}
+	for post in posts: 
+		periods.setdefault(post["date"][:4 if kind == "year" else 7], []).append(post)
+		
+	return [{ 
+		"name": name, 
+		"label": name if kind == "year" else datetime.datetime.strptime(name, "%Y-%m").strftime("%B %Y"), 
+		"path": os.path.join(dst, "{}.html".format(name)),
+		"posts": items
+	} for name, items in periods.items()]
 	
-		def handle_endtag(self, tag):
-			if self.tag is not None and self.tag == tag:
-				if self.nest == 0: self.end = self.getpos()[0] - 1
-				elif self.nest > 0: self.nest -= 1
+def makeArchive(env, posts, dst, layout):
+	#the archive as a page per period, and a small index at dst that links to them. the 
+	#index only lists the periods, so a new post renders the page of its period alone
+	#unless it starts a new one
+	periods = getArchivePeriods(env, posts, os.path.splitext(dst)[0])
+	prepareDirs(env, set(os.path.dirname(period["path"]) for period in periods))
+	
+	for period in periods:
+		makeList(env, period["posts"], period["path"], layout, page_mode="archive", current_period=period["label"], archive_index=dst)
 		
-		def getClasses(self,attrs):
-			classes = list(filter(lambda x: x[0] == "class", attrs))
-			return classes[0][1].split(" ") if classes else []
+	makeList(env, [], dst, layout, page_mode="archive", periods=[{ k: v for k, v in period.items() if k != "posts" } for period in periods])
 	
-	page = fread(dst)
-	fwrite(os.path.join(env.globals["backup_path"],"index." + str(time.time())[:7] + ".html"), page)
+def findPreview(page, preview_class):
+	#a single pass over the tags of the page, skipping comments, scripts and styles. 
+	#returns the offsets between which the preview goes: the end of the line that opens
+	#the preview element, and the start of the line that closes it
+	start, tag, nest = None, None, 0
 	
-	parser = PreviewFinder()
-	parser.feed(page)
-	page = page.split("\n")    
-	page[parser.start] += "\n" + env.get_template(layout).render(post=post)
+	for match in TAG_RE.finditer(page):
+		if match.group("skip"): continue
+		closing, name = match.group("closing"), match.group("name").lower()
+		
+		if start is None:
+			classes = CLASS_RE.search(match.group("attrs")) if not closing else None
+			if classes and preview_class in next(c for c in classes.groups()[1:] if c is not None).split(" "):
+				start, tag = match.end(), name
+				
+		elif name == tag:
+			if not closing: nest += 1
+			elif nest > 0: nest -= 1
+			else:
+				eol = page.find("\n", start)
+				eol = len(page) if eol < 0 else eol
+				return eol, max(page.rfind("\n", 0, match.start()) + 1, eol + 1)
+				
+	return None
+	
+def backupPreview(env, dst, page):
+	#only the latest backup_limit backups of each host page are kept
+	prefix = os.path.splitext(os.path.normpath(dst))[0].replace(os.sep, "_") + "."
+	fwrite(os.path.join(env.globals["backup_path"], prefix + str(int(time.time())) + ".html"), page)
+	
+	with os.scandir(env.globals["backup_path"]) as folder:
+		backups = sorted((item for item in folder if item.name.startswith(prefix) and item.name[len(prefix):-5].isdigit()), 
+			key=lambda item: item.stat().st_mtime_ns)
+	for item in backups[:max(0, len(backups) - env.globals["backup_limit"])]: 
+		os.remove(item.path)
+		
+def insertPreview(env, post, dst, layout):
+	#the offsets of the last splice are kept in the manifest along with the hash of the 
+	#excerpt, so that an unchanged page is neither read nor rewritten, and a page that 
+	#only needs a new excerpt does not have to be scanned
+	manifest = env.globals.get("__manifest")
+	excerpt = env.get_template(layout).render(post=post)
+	digest = hashlib.md5(excerpt.encode("utf-8")).hexdigest()
+	stat = os.stat(getSitePath(env.globals, dst))
+	state = manifest["old_previews"].get(dst) if manifest else None
 	
-	del page[parser.start + 1 : parser.end] #delete remaining old lines
+	if state and state["stat"] == [stat.st_mtime_ns, stat.st_size]:
+		if state["excerpt"] == digest:
+			log(env,"Inserting preview skipped for {} (unchanged) ...", dst)
+			manifest["previews"][dst] = state
+			keepOutput(env, dst)
+			return
+		
+		page = fread(getSitePath(env.globals, dst))
+		offsets = state["offsets"]
+	else:
+		page = fread(getSitePath(env.globals, dst))
+		offsets = findPreview(page, env.globals["preview_class"])
+		
+	if offsets is None:
+		log(env,"WARNING: No element with class {} in {}, preview not inserted", env.globals["preview_class"], dst)
+		return
+	
+	backupPreview(env, dst, page)
 	log(env,"Inserting preview => {} ...", dst)
-	fwrite(dst,"\n".join(page))
+	writeOutput(env, dst, [page[:offsets[0]], "\n", excerpt, "\n", page[offsets[1]:]])
+	flushOutputs(env)
+	
+	if manifest:
+		stat = os.stat(getSitePath(env.globals, dst))
+		manifest["previews"][dst] = {
+			"stat": [stat.st_mtime_ns, stat.st_size],
+			"excerpt": digest,
+			"offsets": [offsets[0], offsets[0] + len(excerpt) + 2]
+		}
 	
 def getTaggedPosts(env,posts):
 	tags = { tag : [] for tag in list(env.globals["all_tags"]) }
@@ -19,13 +19,61 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import os, re, sys, datetime, markdown
+import os, re, sys, hashlib, datetime
+from collections.abc import Mapping
+from functools import partial
+from .backends import getConverter
+from .profiling import span, count
 from .utils import fread, fwrite, log
+from .version import __version__
 	
 def readHeaders(text):
 	for match in re.finditer(r"\s*<!--\s*(.+?)\s*:\s*(.+?)\s*-->\s*|.+", text):
 		if not match.group(1): break
 		yield match.group(1), match.group(2), match.end()
+		
+class Post(Mapping):
+	#a parsed post. metadata stays resident, while prose can be dropped with evict()
+	#and is read back through the loader the next time it is used
+	__slots__ = ("_fields", "_prose", "_digest", "_loader")
+	
+	def __init__(self, fields, prose=None, digest=None, loader=None):
+		self._fields = fields
+		self._prose = prose
+		self._digest = digest or hashlib.md5(prose.encode("utf-8")).hexdigest()
+		self._loader = loader
+		
+	@property
+	def prose(self):
+		if self._prose is None: self._prose = self._loader()
+		return self._prose
+		
+	def evict(self):
+		if self._loader is not None: self._prose = None
+		
+	def getHash(self):
+		return hashlib.md5((str(self._fields) + self._digest).encode("utf-8")).hexdigest()
+		
+	def __getitem__(self, key):
+		return self.prose if key == "prose" else self._fields[key]
+		
+	def __setitem__(self, key, value):
+		if key == "prose": self._prose, self._digest = value, hashlib.md5(value.encode("utf-8")).hexdigest()
+		else: self._fields[key] = value
+		
+	def __iter__(self):
+		yield from self._fields
+		yield "prose"
+		
+	def __len__(self):
+		return len(self._fields) + 1
+		
+	def __repr__(self):
+		return "Post({!r})".format(self._fields)
+		
+	def __reduce__(self):
+		#posts sent to worker processes become plain dicts
+		return (dict, ({ **self._fields, "prose": self._prose if self._prose is not None else self._loader() },))
 
 def formatDate(date_str,kind):
 	d = datetime.datetime.strptime(date_str, "%Y-%m-%d")
@@ -35,40 +83,141 @@ def formatDate(date_str,kind):
 	else: return "{} {}, {}".format(d.day,d.strftime("%B"),d.year)
 
 def readContent(env, filename):
-	text = fread(filename)
-	content = {}
+	from jinja2.filters import do_truncate
+	from markupsafe import Markup
 	
+	#the converter is built before the span, like the imports above, so that the first 
+	#post of each process is not charged for building it
+	convert = None
 	if filename.endswith((".md", ".markdown")):
-		md = markdown.Markdown(extensions=env.globals["markdown_extensions"])
-		try:
-			text = md.convert(text)
-			for k, v in md.Meta.items(): 
-				if len(v) > 1: content[k] = "\n".join(v)
-				else: content[k] = v[0]
-		except ImportError as e:
-			log(env,"WARNING: Cannot render Markdown in {}: {}", filename, str(e))
-	elif filename.endswith((".html", ".htm")):
-		 e = 0
-		 for k, v, e in readHeaders(text): content[k] = v
-		 text = text[e:]
+		try: convert = getConverter(env)
+		except ImportError as e: log(env,"WARNING: Cannot render Markdown in {}: {}", filename, str(e))
+	
+	with span(env, "readContent", "parse", file=filename):
+		text = fread(filename)
+		content = {}
+		
+		if convert is not None:
+			try:
+				with span(env, "markdown", "parse", file=filename):
+					text, meta = convert(text)
+				with span(env, "headers", "parse", file=filename):
+					for k, v in meta.items(): 
+						if len(v) > 1: content[k] = "\n".join(v)
+						else: content[k] = v[0]
+			except ImportError as e:
+				log(env,"WARNING: Cannot render Markdown in {}: {}", filename, str(e))
+		elif filename.endswith((".html", ".htm")):
+			with span(env, "headers", "parse", file=filename):
+				e = 0
+				for k, v, e in readHeaders(text): content[k] = v
+				text = text[e:]
+				
+		if "tags" in content and env.globals["has_tags"]: 
+			content["tags"] = list(map(lambda x: x.strip().replace(" ",""),content["tags"].split(",")))
+		
+		if "date" not in content:
+			content["date"] = datetime.datetime.fromtimestamp(os.path.getmtime(filename)).strftime("%Y-%m-%d")
+			 
+		if "<!-- nvpr -->" in text:
+			content["preview"] = re.sub("<a ?.*?>|<\/a>","",text.split("<!-- nvpr -->")[0])
+
+		return {
+			**content,
+			"name": os.path.splitext(os.path.split(filename)[1])[0],
+			"prose": text,
+			"rfc822_date": formatDate(content["date"],"rfc822"),
+			"rfc3399_date": formatDate(content["date"],"rfc3399"),
+			"neat_date": formatDate(content["date"],"neat"),
+			"summary": do_truncate(env, Markup(text).striptags(), 230),
+			"page_mode": "post"
+		}
+	
+def loadProse(env, filename, prose_file):
+	#prose is read back from the parse cache, and only parsed again if that is missing
+	if os.path.isfile(prose_file): return fread(prose_file)
+	return readContent(env, filename)["prose"]
+	
+def initParseCache(env):
+	#parsed content is only valid for the same trakai version and parsing options
+	key = {
+		"version": __version__,
+		"markdown_backend": env.globals["markdown_backend"],
+		"markdown_extensions": env.globals["markdown_extensions"],
+		"has_tags": env.globals["has_tags"],
+		"format": 2
+	}
+	cache = env.globals.get("__parse_cache")
+	
+	#long-lived environments (see serve.py) keep the cache in memory between builds
+	if cache is None or cache["key"] != key:
+		from .store import loadPosts
+		cache = { "key": key, "entries": {}, "old": loadPosts(env.globals["cache_path"], key), "dirty": set() }
+		env.globals["__parse_cache"] = cache
+	
+	return cache
+	
+def checkParseCache(env, cache, filename, stat):
+	#a matching stat avoids reading the file at all; otherwise fall back to the hash,
+	#so that touched but unchanged files are still hits
+	entry = cache["old"].get(filename)
+	
+	if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+		cache["entries"][filename] = entry
+		count(env, "parse_cache_hits")
+		return getCachedPost(env, cache, filename, entry)
+	
+	with open(filename, "rb") as file: 
+		digest = hashlib.md5(file.read()).hexdigest()
+		
+	cache["dirty"].add(filename)
+		
+	if entry and entry["hash"] == digest:
+		entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+		cache["entries"][filename] = entry
+		count(env, "parse_cache_hits")
+		return getCachedPost(env, cache, filename, entry)
+	
+	cache["entries"][filename] = { "mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": digest }
+	count(env, "parse_cache_misses")
+	return None
+	
+def getCachedPost(env, cache, filename, entry, prose=None):
+	#prose is kept in its own file, so that it can be loaded for each post separately
+	prose_file = os.path.join(env.globals["prose_cache_path"], entry["digest"] + ".html")
+	return Post(dict(entry["content"]), prose, entry["digest"], partial(loadProse, env, filename, prose_file))
+	
+def storeParseCache(env, cache, filename, content):
+	entry = cache["entries"][filename]
+	entry["content"] = { k: v for k, v in content.items() if k != "prose" }
+	entry["digest"] = hashlib.md5(content["prose"].encode("utf-8")).hexdigest()
+	
+	prose_file = os.path.join(env.globals["prose_cache_path"], entry["digest"] + ".html")
+	if not os.path.isfile(prose_file): fwrite(prose_file, content["prose"])
+	
+	return getCachedPost(env, cache, filename, entry, content["prose"])
+	
+def updateParseCache(env, cache, keep=()):
+	#only entries seen in this build are kept, so deleted posts and their prose are dropped.
+	#builds that only read some posts (see Site in build.py) keep the entries of the rest.
+	#the store only gets the entries that changed
+	from .store import savePosts
+	
+	for filename in keep:
+		if filename not in cache["entries"] and filename in cache["old"]: 
+			cache["entries"][filename] = cache["old"][filename]
 			
-	if "tags" in content and env.globals["has_tags"]: 
-		content["tags"] = list(map(lambda x: x.strip().replace(" ",""),content["tags"].split(",")))
+	removed = [filename for filename in cache["old"] if filename not in cache["entries"]]
+	savePosts(env.globals["cache_path"], cache["key"], { filename: cache["entries"][filename] for filename in cache["dirty"] }, removed)
 	
-	print(content)
+	#prose is stored by its hash, so a file is only removed once no entry refers to it
+	digests = set(entry["digest"] for entry in cache["entries"].values())
+	
+	for filename in removed + list(cache["dirty"]):
+		entry = cache["old"].get(filename)
+		if entry is None or entry["digest"] in digests: continue
+		
+		prose_file = os.path.join(env.globals["prose_cache_path"], entry["digest"] + ".html")
+		if os.path.isfile(prose_file): os.remove(prose_file)
 			
-	if "date" not in content:
-		content["date"] = datetime.datetime.fromtimestamp(stat.ST_MTIME).strftime("%Y-%m-%d")
-		 
-	if "<!-- nvpr -->" in text:
-		content["preview"] = re.sub("<a ?.*?>|<\/a>","",text.split("<!-- nvpr -->")[0])
-
-	return {
-		**content,
-		"name": os.path.splitext(os.path.split(filename)[1])[0],
-		"prose": text,
-		"rfc822_date": formatDate(content["date"],"rfc822"),
-		"rfc3399_date": formatDate(content["date"],"rfc3399"),
-		"neat_date": formatDate(content["date"],"neat"),
-		"page_mode": "post"
-	}
\ No newline at end of file
+	cache.update(old=cache["entries"], entries={}, dirty=set())
@@ -0,0 +1,116 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import os, re, zlib, hashlib
+from functools import partial
+
+#tags are copied as they are, so only the text between them is collapsed
+TOKEN_RE = re.compile(r"""
+	(?P<raw><(pre|textarea|script|style)\b.*?</\2\s*>)
+	|<!\[CDATA\[(?P<cdata>.*?)\]\]>
+	|<!--(?P<comment>.*?)-->
+	|(?P<text>[^<]+)
+	|<[^>]*>
+	|<
+""", re.S | re.I | re.X)
+SPACE_RE = re.compile(r"\s+")
+OPEN_RE = re.compile(r"<(pre|textarea|script|style)\b|<!--|<!\[CDATA\[", re.I) #tokens that may still be open
+
+def collapseSpace(match):
+	#a run of whitespace is the same as a single space in html, but newlines are
+	#kept so that the output is still readable
+	return "\n" if "\n" in match.group(0) else " "
+
+def minifyToken(match):
+	if match.group("cdata") is not None:
+		return "<![CDATA[" + minifyMarkup(match.group("cdata")) + "]]>"
+	elif match.group("comment") is not None:
+		#the nvpr marker and conditional comments are kept, other comments are dropped
+		comment = match.group("comment").strip()
+		return match.group(0) if comment == "nvpr" or comment.startswith("[if") else ""
+	elif match.group("text") is not None:
+		return SPACE_RE.sub(collapseSpace, match.group("text"))
+	return match.group(0)
+
+def minifyMarkup(text):
+	#strips comments and collapses whitespace in html and xml, leaving pre, textarea,
+	#script and style elements alone
+	return TOKEN_RE.sub(minifyToken, text)
+
+def findCut(text):
+	#the end of the last token of text that is known to be complete. text after the last
+	#tag may go on in the next chunk, as may an element whose closing tag is not there yet
+	cut = 0
+
+	for match in TOKEN_RE.finditer(text):
+		if match.group("text") is not None: continue
+		if match.group("raw") is None and match.group("cdata") is None and match.group("comment") is None \
+			and (match.group(0) == "<" or OPEN_RE.match(match.group(0))): break
+		cut = match.end()
+
+	return cut
+
+def minifyStream(chunks):
+	#minifies an iterable of strings as it is written, such as the output of 
+	#Template.generate(). only whole tokens are minified, and the rest of each chunk is
+	#carried over to the next, so the result is the same as that of minifyMarkup
+	carry = ""
+
+	for chunk in chunks:
+		carry += chunk
+		cut = findCut(carry)
+
+		if cut:
+			yield minifyMarkup(carry[:cut])
+			carry = carry[cut:]
+
+	if carry: yield minifyMarkup(carry)
+
+def writeGzip(filename, level=9, sync=False):
+	#writes filename.gz next to filename, compressing it a block at a time. zlib leaves 
+	#the timestamp in the gzip header empty, so the same input always gives the same 
+	#sidecar. returns its hash
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+	output = hashlib.md5()
+	temp = "{}.gz.{}.tmp".format(filename, os.getpid())
+
+	try:
+		with open(filename, "rb") as source, open(temp, "wb") as f:
+			for block in iter(partial(source.read, 1 << 16), b""):
+				data = compressor.compress(block)
+				f.write(data)
+				output.update(data)
+
+			data = compressor.flush()
+			f.write(data)
+			output.update(data)
+
+			if sync:
+				f.flush()
+				os.fsync(f.fileno())
+
+		os.replace(temp, filename + ".gz")
+	except BaseException:
+		if os.path.isfile(temp): os.remove(temp)
+		raise
+
+	return output.hexdigest()
@@ -0,0 +1,136 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os, json, time
+from collections import defaultdict
+from contextlib import contextmanager
+from .utils import fwrite, log
+
+def newProfile():
+	return { "events": [], "counters": defaultdict(int) }
+
+def initProfile(env):
+	#profiling is off unless profile_path is set. worker processes get an empty profile
+	#of their own, which is sent back with each result, see runWorker in output.py
+	if not env.globals["profile_path"]: return
+
+	profile = newProfile()
+	profile["start"] = time.perf_counter()
+	profile["hook"] = env.globals["profile_hook"]
+	env.globals["__profile"] = profile
+
+	if profile["hook"] == "cprofile":
+		import cProfile
+		profile["profiler"] = cProfile.Profile()
+		profile["profiler"].enable()
+	elif profile["hook"] == "tracemalloc":
+		import tracemalloc
+		tracemalloc.start()
+
+@contextmanager
+def span(env, name, category="stage", **args):
+	profile = env.globals.get("__profile")
+	if profile is None:
+		yield
+		return
+
+	start = time.perf_counter()
+	try: yield
+	finally: profile["events"].append((name, category, start, time.perf_counter() - start, os.getpid(), args))
+
+def count(env, counter, amount=1):
+	profile = env.globals.get("__profile")
+	if profile is not None: profile["counters"][counter] += amount
+
+def drainProfile(env):
+	#returns what a worker recorded since the last call, to be merged by the parent
+	profile = env.globals["__profile"]
+	events, counters = profile["events"], dict(profile["counters"])
+	profile.update(events=[], counters=defaultdict(int))
+	return events, counters
+
+def mergeProfile(env, events, counters):
+	profile = env.globals["__profile"]
+	profile["events"].extend(events)
+	for counter, amount in counters.items(): profile["counters"][counter] += amount
+
+def summariseEvents(events, category):
+	summary = defaultdict(lambda: { "time": 0.0, "calls": 0 })
+
+	for name, cat, start, duration, pid, args in events:
+		if cat != category: continue
+		summary[name]["time"] += duration
+		summary[name]["calls"] += 1
+
+	return dict(sorted(summary.items(), key=lambda x: x[1]["time"], reverse=True))
+
+def summarisePosts(events):
+	posts = defaultdict(lambda: { "total": 0.0, "markdown": 0.0, "headers": 0.0 })
+
+	for name, cat, start, duration, pid, args in events:
+		if cat != "parse": continue
+		posts[args["file"]]["total" if name == "readContent" else name] += duration
+
+	return [{ "file": k, **v } for k, v in sorted(posts.items(), key=lambda x: x[1]["total"], reverse=True)]
+
+def writeProfile(env):
+	#writes a json report, and a timeline next to it that can be opened in chrome://tracing
+	#or Perfetto. the optional hooks add a cProfile dump or the largest allocations
+	profile = env.globals.pop("__profile")
+	report_path = env.globals["profile_path"]
+	trace_path = os.path.splitext(report_path)[0] + ".trace.json"
+
+	report = {
+		"total": time.perf_counter() - profile["start"],
+		"stages": summariseEvents(profile["events"], "stage"),
+		"templates": summariseEvents(profile["events"], "render"),
+		"posts": summarisePosts(profile["events"]),
+		"counters": dict(sorted(profile["counters"].items()))
+	}
+
+	if profile["hook"] == "cprofile":
+		profile["profiler"].disable()
+		profile["profiler"].dump_stats(os.path.splitext(report_path)[0] + ".prof")
+	elif profile["hook"] == "tracemalloc":
+		import tracemalloc
+		current, peak = tracemalloc.get_traced_memory()
+		report["memory"] = {
+			"current": current,
+			"peak": peak,
+			"top": [{ "line": str(stat.traceback), "size": stat.size, "count": stat.count }
+				for stat in tracemalloc.take_snapshot().statistics("lineno")[:25]]
+		}
+		tracemalloc.stop()
+
+	trace = { "traceEvents": [{
+		"name": name if name != "readContent" else args["file"],
+		"cat": category,
+		"ph": "X",
+		"ts": (start - profile["start"]) * 1e6,
+		"dur": duration * 1e6,
+		"pid": 0,
+		"tid": pid,
+		"args": args
+	} for name, category, start, duration, pid, args in profile["events"]]}
+
+	fwrite(report_path, json.dumps(report, indent="\t"))
+	fwrite(trace_path, json.dumps(trace))
+	log(env,"Profile written to {} and {} ...", report_path, trace_path)
@@ -0,0 +1,42 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+
+import re, html
+
+SKIP_RE = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.S | re.I)
+TAG_RE = re.compile(r"<[^>]*>")
+WORD_RE = re.compile(r"\w{2,}")
+
+def countTerms(text):
+	#the number of times each word appears in the text of a post, ignoring markup
+	counts = {}
+	text = html.unescape(TAG_RE.sub(" ", SKIP_RE.sub(" ", text))).lower()
+
+	for term in WORD_RE.findall(text):
+		counts[term] = counts.get(term, 0) + 1
+
+	return counts
+
+def getPrefix(term, length):
+	#terms are sharded by their first characters, so a browser looking up a word only
+	#fetches the shard of its prefix
+	return term[:length]
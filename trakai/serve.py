@@ -0,0 +1,112 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os, time, threading, traceback
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from .build import generateSite
+from .utils import log, scanSources
+
+RELOAD_PATH = "/__trakai/build"
+RELOAD_SCRIPT = """<script>
+(function(build) {{
+	setInterval(function() {{
+		fetch("{}").then(function(r) {{ return r.text(); }}).then(function(b) {{
+			if (build === null) build = b;
+			else if (b !== build) window.location.reload();
+		}}).catch(function() {{}});
+	}}, 1000);
+}})(null);
+</script>
+""".format(RELOAD_PATH)
+
+class PreviewHandler(SimpleHTTPRequestHandler):
+	def do_GET(self):
+		if self.path == RELOAD_PATH:
+			self.sendBody(str(self.server.build).encode("utf-8"), "text/plain")
+			return
+
+		filename = self.translate_path(self.path)
+		if os.path.isdir(filename): filename = os.path.join(filename, "index.html")
+
+		#pages are served with a small script that reloads them after each build
+		if self.server.livereload and filename.endswith((".html", ".htm")) and os.path.isfile(filename):
+			with open(filename, "rb") as file: page = file.read()
+			script = RELOAD_SCRIPT.encode("utf-8")
+			index = page.rfind(b"</body>")
+
+			self.sendBody(page[:index] + script + page[index:] if index >= 0 else page + script, "text/html")
+			return
+
+		super().do_GET()
+
+	def sendBody(self, body, kind):
+		self.send_response(200)
+		self.send_header("Content-Type", kind + "; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.send_header("Cache-Control", "no-store")
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		log(self.server.env, "Serving {}", format % args)
+
+def watchSite(env, interval=0.5, callback=None):
+	#posts and templates are polled, so this works the same on every platform. the
+	#environment, parse cache and build graph stay in memory, so each rebuild only
+	#parses changed posts and renders the outputs that depend on them
+	snapshot = scanSources([env.globals["posts_path"], env.globals["templates_path"]])
+	log(env, "Watching {} and {} for changes ...", env.globals["posts_path"], env.globals["templates_path"])
+
+	while True:
+		time.sleep(interval)
+		current = scanSources([env.globals["posts_path"], env.globals["templates_path"]])
+		if current == snapshot: continue
+
+		snapshot = current
+		start = time.perf_counter()
+
+		try:
+			generateSite(env)
+		except Exception:
+			log(env, "ERROR: Rebuild failed:\n{}", traceback.format_exc())
+			continue
+
+		log(env, "Rebuilt in {:.3f}s", time.perf_counter() - start)
+		if callback: callback()
+
+def serveSite(env, host="localhost", port=8000, livereload=False, interval=0.5):
+	server = ThreadingHTTPServer((host, port), partial(PreviewHandler, directory=env.globals["site_path"]))
+	server.env, server.build, server.livereload = env, 0, livereload
+
+	def rebuilt(): server.build += 1
+
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	log(env, "Serving {} at http://{}:{}/ ...", env.globals["site_path"], host, port)
+
+	try:
+		watchSite(env, interval, rebuilt)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.shutdown()
+		server.server_close()
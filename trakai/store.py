@@ -0,0 +1,207 @@
+"""
+The MIT License (MIT)
+
+Copyright (c) 2020 novov
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the "Software"), to deal in the
+Software without restriction, including without limitation the rights to use, copy, modify, merge,
+publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom
+the Software is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies or
+substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT
+NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT
+OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import os, json, time, sqlite3
+from contextlib import closing
+
+#bumped whenever the tables change. a store with another version is rebuilt from scratch
+SCHEMA_VERSION = 4
+SCHEMA = (
+	"CREATE TABLE outputs (dst TEXT PRIMARY KEY, hash TEXT NOT NULL, posts TEXT NOT NULL, templates TEXT NOT NULL)",
+	"CREATE TABLE tags (tag TEXT PRIMARY KEY, hash TEXT NOT NULL, posts TEXT NOT NULL, outputs TEXT NOT NULL)",
+	"CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+	"CREATE TABLE posts (file TEXT PRIMARY KEY, entry TEXT NOT NULL)",
+	"CREATE TABLE fragments (key TEXT PRIMARY KEY, post TEXT NOT NULL, hash TEXT NOT NULL, html TEXT NOT NULL)",
+	"CREATE TABLE search_posts (name TEXT PRIMARY KEY, id INTEGER NOT NULL, hash TEXT NOT NULL)",
+	"CREATE TABLE postings (prefix TEXT NOT NULL, term TEXT NOT NULL, id INTEGER NOT NULL, tf INTEGER NOT NULL)",
+	"CREATE INDEX postings_prefix ON postings (prefix)",
+	"CREATE INDEX postings_id ON postings (id)",
+	"CREATE TABLE search_shards (prefix TEXT PRIMARY KEY, file TEXT NOT NULL, hash TEXT NOT NULL)",
+)
+TABLES = ("outputs", "tags", "meta", "posts", "fragments", "search_posts", "postings", "search_shards")
+
+def openStore(filename):
+	#the store only holds what can be rebuilt, so one that cannot be read, such as
+	#the json cache of older versions, is replaced rather than migrated
+	if os.path.dirname(filename):
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+	try:
+		db = sqlite3.connect(filename)
+		version = db.execute("PRAGMA user_version").fetchone()[0]
+	except sqlite3.DatabaseError:
+		db.close()
+		os.remove(filename)
+		db = sqlite3.connect(filename)
+		version = 0
+
+	if version != SCHEMA_VERSION:
+		with db:
+			for table in TABLES: db.execute("DROP TABLE IF EXISTS " + table)
+			for statement in SCHEMA: db.execute(statement)
+			db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+
+	return db
+
+def loadStore(filename):
+	#returns the outputs and tags of the last build, in the form used by the build graph
+	if not os.path.isfile(filename): return {}, {}
+
+	with closing(openStore(filename)) as db:
+		outputs = { dst: { "posts": json.loads(posts), "templates": json.loads(templates), "hash": digest }
+			for dst, digest, posts, templates in db.execute("SELECT dst, hash, posts, templates FROM outputs") }
+		tags = { tag: { "posts": json.loads(posts), "outputs": json.loads(outputs), "hash": digest }
+			for tag, digest, posts, outputs in db.execute("SELECT tag, hash, posts, outputs FROM tags") }
+
+	return outputs, tags
+
+def saveStore(filename, old, outputs, old_tags, tags):
+	#only entries that changed are written, and entries the build no longer produced
+	#are evicted. returns the evicted outputs
+	evicted = [dst for dst in old if dst not in outputs]
+
+	with closing(openStore(filename)) as db, db:
+		db.executemany("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)", [
+			(dst, entry["hash"], json.dumps(entry["posts"]), json.dumps(entry["templates"]))
+			for dst, entry in outputs.items() if old.get(dst) != entry
+		])
+		db.executemany("DELETE FROM outputs WHERE dst = ?", [(dst,) for dst in evicted])
+		db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)", [
+			(tag, entry["hash"], json.dumps(entry["posts"]), json.dumps(entry["outputs"]))
+			for tag, entry in tags.items() if old_tags.get(tag) != entry
+		])
+		db.executemany("DELETE FROM tags WHERE tag = ?", [(tag,) for tag in old_tags if tag not in tags])
+		db.execute("INSERT OR REPLACE INTO meta VALUES ('last_build', ?)", (json.dumps(time.time()),))
+
+	return evicted
+
+def getMeta(db, key):
+	value = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+	return json.loads(value[0]) if value else None
+
+def loadPosts(filename, key):
+	#returns the parse cache entries of the last build, or none if they were parsed with 
+	#another key, such as other markdown options
+	if not os.path.isfile(filename): return {}
+	
+	with closing(openStore(filename)) as db:
+		if getMeta(db, "parse_key") != key: return {}
+		return { file: json.loads(entry) for file, entry in db.execute("SELECT file, entry FROM posts") }
+		
+def savePosts(filename, key, changed, removed):
+	#writes the parse cache entries that changed, and deletes those of removed posts
+	with closing(openStore(filename)) as db, db:
+		if getMeta(db, "parse_key") != key:
+			db.execute("DELETE FROM posts")
+			db.execute("INSERT OR REPLACE INTO meta VALUES ('parse_key', ?)", (json.dumps(key),))
+			
+		db.executemany("INSERT OR REPLACE INTO posts VALUES (?, ?)", [(file, json.dumps(entry)) for file, entry in changed.items()])
+		db.executemany("DELETE FROM posts WHERE file = ?", [(file,) for file in removed])
+	
+def loadFragments(db):
+	#the post and hash of each fragment. their html is only read when they are reused
+	return { key: (post, digest) for key, post, digest in db.execute("SELECT key, post, hash FROM fragments") }
+	
+def getFragment(db, key):
+	return db.execute("SELECT html FROM fragments WHERE key = ?", (key,)).fetchone()[0]
+	
+def saveFragments(db, changed, removed):
+	with db:
+		db.executemany("INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)", [
+			(key, entry["post"], entry["hash"], entry["html"]) for key, entry in changed.items()
+		])
+		db.executemany("DELETE FROM fragments WHERE key = ?", [(key,) for key in removed])
+	
+def loadSearch(db, key):
+	#the id and hash of each indexed post, and the file and hash of each shard. an index
+	#built with another key, such as another prefix length, is cleared
+	if getMeta(db, "search_key") != key:
+		with db:
+			for table in ("search_posts", "postings", "search_shards"): db.execute("DELETE FROM " + table)
+			db.execute("INSERT OR REPLACE INTO meta VALUES ('search_key', ?)", (json.dumps(key),))
+			
+	posts = { name: (id, digest) for name, id, digest in db.execute("SELECT name, id, hash FROM search_posts") }
+	shards = { prefix: { "file": file, "hash": digest } for prefix, file, digest in db.execute("SELECT prefix, file, hash FROM search_shards") }
+	return posts, shards
+	
+def updatePostings(db, changed, removed):
+	#replaces the postings of changed posts, given by name as (id, hash, postings) with
+	#postings as (prefix, term, tf), and deletes those of removed posts, given by name as
+	#ids. returns the prefixes whose postings changed. nothing is committed here, see saveShards
+	touched = set()
+	
+	for id in [entry[0] for entry in changed.values()] + list(removed.values()):
+		touched.update(prefix for prefix, in db.execute("SELECT DISTINCT prefix FROM postings WHERE id = ?", (id,)))
+		db.execute("DELETE FROM postings WHERE id = ?", (id,))
+		
+	db.executemany("DELETE FROM search_posts WHERE name = ?", [(name,) for name in removed])
+	db.executemany("INSERT OR REPLACE INTO search_posts VALUES (?, ?, ?)", [(name, id, digest) for name, (id, digest, postings) in changed.items()])
+	db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", [
+		(prefix, term, id, tf) for id, digest, postings in changed.values() for prefix, term, tf in postings
+	])
+	
+	touched.update(prefix for id, digest, postings in changed.values() for prefix, term, tf in postings)
+	return touched
+	
+def getPostings(db, prefix):
+	#the postings of each term with the prefix, as [id, tf] sorted by id
+	terms = {}
+	
+	for term, id, tf in db.execute("SELECT term, id, tf FROM postings WHERE prefix = ? ORDER BY term, id", (prefix,)):
+		terms.setdefault(term, []).append([id, tf])
+		
+	return terms
+	
+def saveShards(db, changed, removed):
+	#commits the shards along with the postings written by updatePostings
+	with db:
+		db.executemany("INSERT OR REPLACE INTO search_shards VALUES (?, ?, ?)", [
+			(prefix, entry["file"], entry["hash"]) for prefix, entry in changed.items()
+		])
+		db.executemany("DELETE FROM search_shards WHERE prefix = ?", [(prefix,) for prefix in removed])
+	
+def getStoreStats(filename):
+	if not os.path.isfile(filename): return None
+
+	with closing(openStore(filename)) as db:
+		last_build = getMeta(db, "last_build")
+
+		return {
+			"schema": db.execute("PRAGMA user_version").fetchone()[0],
+			"outputs": db.execute("SELECT COUNT(*) FROM outputs").fetchone()[0],
+			"tags": db.execute("SELECT COUNT(*) FROM tags").fetchone()[0],
+			"posts": db.execute("SELECT COUNT(*) FROM posts").fetchone()[0],
+			"fragments": db.execute("SELECT COUNT(*) FROM fragments").fetchone()[0],
+			"indexed": db.execute("SELECT COUNT(*) FROM search_posts").fetchone()[0],
+			"size": os.path.getsize(filename),
+			"free": db.execute("PRAGMA freelist_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0],
+			"last_build": last_build
+		}
+
+def vacuumStore(filename):
+	#returns the size of the store before and after
+	if not os.path.isfile(filename): return None
+	size = os.path.getsize(filename)
+
+	with closing(openStore(filename)) as db:
+		db.execute("VACUUM")
+
+	return size, os.path.getsize(filename)
@@ -19,16 +19,63 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-import os, sys, shutil
+import os, sys, shutil, hashlib
 
 def fread(filename):
 	with open(filename, "r") as f: return f.read()
 
 def fwrite(filename, text):
+	fstream(filename, [text])
+	
+def fstream(filename, chunks, digest=None, sync=False, makedirs=True):
+	#writes an iterable of strings, such as the output of Template.generate(), without
+	#joining it in memory first. the output goes to a temporary file that replaces the
+	#target once complete, or is discarded if it hashes the same as digest. returns
+	#the hash of the output and whether the target was written
 	basedir = os.path.dirname(filename)
-	if not os.path.isdir(basedir) and basedir != "":
-		os.makedirs(basedir)
-	with open(filename, "w") as f: f.write(text)
+	if makedirs and not os.path.isdir(basedir) and basedir != "":
+		os.makedirs(basedir, exist_ok=True)
+		
+	temp = "{}.{}.tmp".format(filename, os.getpid())
+	output = hashlib.md5()
+	
+	try:
+		with open(temp, "w", buffering=65536) as f: 
+			for chunk in chunks:
+				f.write(chunk)
+				output.update(chunk.encode("utf-8"))
+				
+			#identical outputs are discarded below, so they are not synced
+			if sync and not (output.hexdigest() == digest and os.path.isfile(filename)):
+				f.flush()
+				os.fsync(f.fileno())
+				
+		if output.hexdigest() == digest and os.path.isfile(filename):
+			os.remove(temp)
+			return digest, False
+			
+		os.replace(temp, filename)
+		return output.hexdigest(), True
+	except BaseException:
+		if os.path.isfile(temp): os.remove(temp)
+		raise
+
+def getSitePath(params, filename):
+	#outputs and host pages are named relative to the site, which need not be the
+	#working directory. absolute paths, such as those of the build state, are kept
+	return os.path.join(params["site_path"], filename)
+
+def scanSources(folders):
+	#a snapshot of every file in folders, used to tell whether any have changed
+	snapshot = {}
+
+	for folder in folders:
+		for root, dirs, files in os.walk(folder):
+			for name in files:
+				stat = os.stat(os.path.join(root, name))
+				snapshot[os.path.join(root, name)] = [stat.st_mtime_ns, stat.st_size]
+
+	return snapshot
 
 def log(env, msg, *args):
 	if env.globals["__silent"]: return